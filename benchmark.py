@@ -0,0 +1,363 @@
+"""Benchmarks for move generation, evaluation and search in checkers.py.
+
+Usage:
+    python benchmark.py [--perft-depth N] [--depths 3 4 5] [--save FILE] [--compare FILE]
+    python benchmark.py --validate BOARDS [--perft-depth N]
+
+The results are printed as JSON. --save writes them to FILE to be used as a baseline
+later, and --compare reads a baseline from FILE, prints the change of every measure
+and exits with status 1 if a perft count changed, a search visits more nodes or a time
+got slower than the tolerance.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+import checkers
+
+# The fixed corpus: red is to move on every board.
+POSITIONS = {
+    'opening-start': """\
+.b.b.b.b
+b.b.b.b.
+.b.b.b.b
+........
+........
+r.r.r.r.
+.r.r.r.r
+r.r.r.r.
+""",
+    'opening-2': """\
+.b.b.b.b
+b.b.b.b.
+.b.b.b.b
+........
+...r....
+r.r...r.
+.r.r.r.r
+r.r.r.r.
+""",
+    'opening-3': """\
+.b.b.b.b
+b.b...b.
+.b.b.b.b
+......b.
+.r.r....
+....r.r.
+.r.r.r.r
+r.r.r.r.
+""",
+    'midgame-1': """\
+.b.....b
+b.....b.
+.b.b...b
+r.b.r.b.
+...r.r..
+..r...b.
+...r.r.r
+r.....r.
+""",
+    'midgame-2': """\
+.b.b.b.b
+b...r.b.
+.....b.b
+b.....r.
+........
+r.r.b.r.
+...r.r..
+r.r.r.r.
+""",
+    'midgame-3': """\
+.b.b...b
+b.b.b.b.
+.b.....b
+....b.b.
+.r.....r
+r.r.b.r.
+.r.r...r
+r...r.r.
+""",
+    'midgame-4': """\
+.b.b.b..
+..b.b.b.
+.......b
+..b.b.b.
+.....r.r
+r.b.r...
+.r...r.r
+r.r.r...
+""",
+    'kings-1': """\
+........
+B...R...
+........
+B.......
+.r.....R
+........
+.....b..
+........
+""",
+    'kings-2': """\
+........
+........
+........
+........
+.b......
+..R...r.
+.......B
+....r.B.
+""",
+    'kings-3': """\
+........
+........
+.R.r....
+........
+........
+R.......
+........
+....B.B.
+""",
+    'kings-4': """\
+........
+....B...
+........
+......b.
+...R....
+........
+........
+......R.
+""",
+    'jumps-1': """\
+.b.b.b..
+....r.b.
+.b...b.b
+....r...
+.b......
+r.r.r...
+...r.r..
+r.r.....
+""",
+    'jumps-2': """\
+.....b.b
+..b.r.b.
+........
+b.b.b.b.
+.r.r.r.b
+r.r.....
+........
+r.B...B.
+""",
+    'jumps-3': """\
+...R.b.b
+..b...b.
+.....r..
+b.b...b.
+.r...r.b
+r.r.....
+.....B..
+r.B.....
+""",
+    'jumps-4': """\
+.b.b....
+r.R.....
+........
+..R.r...
+...r....
+....b.R.
+.b.....B
+......B.
+""",
+}
+
+
+def load_positions() -> dict[str, checkers.State]:
+    """Return the corpus as States, by name."""
+    return {name: checkers.lines_to_state(text.splitlines(), name) for name, text in POSITIONS.items()}
+
+
+def bench_generate(positions: dict, depth: int) -> dict:
+    """Count the boards reached from every position in depth moves with both generators."""
+    result = {'depth': depth}
+    for name, reference in (('generate_moves', False), ('expand', True)):
+        nodes = {}
+        start = time.perf_counter()
+        for position, state in positions.items():
+            nodes[position] = checkers.perft(state, 'r', depth, reference)
+        seconds = time.perf_counter() - start
+        result[name] = {'nodes': nodes, 'seconds': seconds,
+                        'nodes_per_second': sum(nodes.values()) / seconds}
+    return result
+
+
+def bench_evaluate(positions: dict, repeat: int) -> dict:
+    """Time evaluate() and heuristic() on every position and on the boards one move away."""
+    boards = []
+    for state in positions.values():
+        boards.append(state)
+        boards.extend(checkers.generate_successors(state, 'r'))
+    result = {'boards': len(boards)}
+    for name, function in (('evaluate', checkers.evaluate), ('heuristic', checkers.heuristic)):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for board in boards:
+                function(board)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        result[name] = {'calls_per_second': len(boards) / best}
+    # evaluate_batch scores all the boards in one call (with NumPy if it is installed).
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        checkers.evaluate_batch(boards)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    result['evaluate_batch'] = {'calls_per_second': len(boards) / best, 'numpy': checkers.np is not None}
+    return result
+
+
+def bench_search(positions: dict, depths: list[int], engine: str = 'alphabeta') -> dict:
+    """Run ab_search (with a transposition table and engine) on every position at every depth."""
+    result = {}
+    for depth in depths:
+        per_position = {}
+        for name, state in positions.items():
+            context = checkers.SearchContext(checkers.TranspositionTable(), engine=engine)
+            start = time.perf_counter()
+            checkers.ab_search(state, depth, context)
+            per_position[name] = {'nodes': context.nodes, 'seconds': time.perf_counter() - start}
+        result[str(depth)] = {'positions': per_position,
+                              'nodes': sum(p['nodes'] for p in per_position.values()),
+                              'seconds': sum(p['seconds'] for p in per_position.values())}
+    return result
+
+
+def validate(states, depth: int) -> list[str]:
+    """
+    Compare checkers.perft_divide in the fast and reference modes on every board of
+    states, both players moving first, and return a line for every count that differs.
+    Also check has_any_move, evaluate_batch against heuristic, and that the captures and
+    the steps generated apart make the same moves.
+    """
+    lines = []
+    for i, state in enumerate(states):
+        for player in ('r', 'b'):
+            fast = checkers.perft_divide(state, player, depth)
+            reference = checkers.perft_divide(state, player, depth, reference=True)
+            for board in fast.keys() | reference.keys():
+                if fast.get(board) != reference.get(board):
+                    after = checkers.State(*board)
+                    lines.append(f"board {i} ({player} to move), after the move to\n{after}"
+                                 f"generate_moves: {fast.get(board)}, expand: {reference.get(board)}")
+            if list(fast) != list(reference):
+                lines.append(f"board {i} ({player} to move): the moves are in a different order")
+            moves = checkers.generate_moves(state, player)
+            successors = checkers.generate_successors(state, player)
+            if checkers.evaluate_batch(successors) != [checkers.heuristic(s) for s in successors]:
+                lines.append(f"board {i} ({player} to move): evaluate_batch differs from heuristic")
+            if checkers.has_any_move(state, player) != bool(reference):
+                lines.append(f"board {i} ({player} to move): has_any_move differs from expand")
+            staged = checkers.generate_captures(state, player) + checkers.generate_steps(state, player)
+            if sorted(staged) != sorted(moves):
+                lines.append(f"board {i} ({player} to move): generate_captures and generate_steps "
+                             f"differ from generate_moves")
+    return lines
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Return a line for every measure that is in both result and baseline, and mark
+    with 'REGRESSION' the perft counts that changed, the searches that visit more nodes
+    and the times more than tolerance slower.
+    """
+    lines = []
+
+    def check_count(label, new, old):
+        mark = '' if new == old else '  REGRESSION (count changed)'
+        lines.append(f"{label}: {old} -> {new}{mark}")
+
+    def check_time(label, new, old):
+        ratio = new / old if old else float('inf')
+        mark = '  REGRESSION' if ratio > 1 + tolerance else ''
+        lines.append(f"{label}: {old:.4f}s -> {new:.4f}s (x{ratio:.2f}){mark}")
+
+    def check_rate(label, new, old):
+        ratio = new / old if old else float('inf')
+        mark = '  REGRESSION' if ratio < 1 / (1 + tolerance) else ''
+        lines.append(f"{label}: {old:.0f}/s -> {new:.0f}/s (x{ratio:.2f}){mark}")
+
+    generate, old_generate = result.get('generate'), baseline.get('generate')
+    if generate and old_generate and generate['depth'] == old_generate['depth']:
+        for name in ('generate_moves', 'expand'):
+            for position, nodes in generate[name]['nodes'].items():
+                if position in old_generate[name]['nodes']:
+                    check_count(f"perft {name} {position}", nodes, old_generate[name]['nodes'][position])
+            check_time(f"perft {name}", generate[name]['seconds'], old_generate[name]['seconds'])
+    if 'evaluate' in result and 'evaluate' in baseline:
+        for name in ('evaluate', 'heuristic', 'evaluate_batch'):
+            if name not in result['evaluate'] or name not in baseline['evaluate']:
+                continue
+            check_rate(f"{name} calls", result['evaluate'][name]['calls_per_second'],
+                       baseline['evaluate'][name]['calls_per_second'])
+    for depth, search in result.get('search', {}).items():
+        old_search = baseline.get('search', {}).get(depth)
+        if old_search is None:
+            continue
+        for position, measure in search['positions'].items():
+            if position in old_search['positions']:
+                old_nodes = old_search['positions'][position]['nodes']
+                mark = '  REGRESSION (more nodes)' if measure['nodes'] > old_nodes else ''
+                lines.append(f"search depth {depth} {position} nodes: {old_nodes} -> {measure['nodes']}{mark}")
+        check_time(f"search depth {depth}", search['seconds'], old_search['seconds'])
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark move generation, evaluation and search.")
+    parser.add_argument('--perft-depth', type=int, default=3,
+                        help="depth of the perft move generation count (default 3)")
+    parser.add_argument('--depths', type=int, nargs='+', default=[3, 4, 5, 6, 7, 8, 9],
+                        help="ab_search depths (default 3 to 9)")
+    parser.add_argument('--engine', choices=['alphabeta', 'pvs'], default='alphabeta',
+                        help="search engine of the search benchmark (default alphabeta)")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="repetitions of the evaluation timing; the best is kept (default 5)")
+    parser.add_argument('--only', nargs='+', choices=['generate', 'evaluate', 'search'],
+                        default=['generate', 'evaluate', 'search'], help="benchmarks to run")
+    parser.add_argument('--save', default=None, help="write the results to this file")
+    parser.add_argument('--compare', default=None, help="compare the results with this saved file")
+    parser.add_argument('--validate', default=None,
+                        help="instead of benchmarking, compare the fast and reference perft counts "
+                             "(split by first move, at --perft-depth) on every board of this file, "
+                             "directory or - for stdin, and exit with status 1 on any difference")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="slowdown allowed by --compare before reporting a regression (default 0.1)")
+    args = parser.parse_args()
+
+    if args.validate is not None:
+        report = validate(checkers.read_boards(args.validate), args.perft_depth)
+        print('\n'.join(report) if report else "no difference")
+        sys.exit(1 if report else 0)
+
+    positions = load_positions()
+    results = {'python': platform.python_version(), 'positions': sorted(positions)}
+    if 'generate' in args.only:
+        results['generate'] = bench_generate(positions, args.perft_depth)
+    if 'evaluate' in args.only:
+        results['evaluate'] = bench_evaluate(positions, args.repeat)
+    if 'search' in args.only:
+        results['search'] = bench_search(positions, args.depths, args.engine)
+
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            report = compare(results, json.load(f), args.tolerance)
+        print('\n'.join(report), file=sys.stderr)
+        if any('REGRESSION' in line for line in report):
+            sys.exit(1)
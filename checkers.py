@@ -1,91 +1,231 @@
 """Assignment 2 Game Tree Search"""
+import argparse
+import json
 import math
+import mmap
+import multiprocessing
+import os
+import random
+import struct
 import sys
+import time
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
 from heapq import heappush, heappop
-from dataclasses import dataclass, field
-from typing import Any
+from itertools import repeat
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is optional: without it evaluate_batch calls evaluate() on each board.
+    np = None
+
+
+# Only the 32 dark squares (x + y is odd) can ever hold a piece, so a board is
+# stored as 32-bit masks over those squares. Square i is in row i // 4, hence
+# walking the bits of a mask from low to high visits the pieces in the same
+# row-major order as the input file.
+SQUARE_POSITIONS = [(2 * (i % 4) + 1 - (i // 4) % 2, i // 4) for i in range(32)]
+SQUARE_MASKS = {position: 1 << i for i, position in enumerate(SQUARE_POSITIONS)}
+
+
+def square_mask(position: tuple) -> int:
+    """Return the bit of position, or 0 if position is off the board or a white space."""
+    return SQUARE_MASKS.get(position, 0)
+
+
+def squares(mask: int):
+    """Yield the index of every set bit of mask, from the lowest to the highest."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+# Diagonal directions as (dx, dy): 0 and 1 go up the board (forward for red),
+# 2 and 3 go down the board (forward for black).
+DIRECTIONS = [(-1, -1), (1, -1), (-1, 1), (1, 1)]
+# Directions a piece may move or capture in, in the order expand_single tries them,
+# keyed by (player, is_king).
+PIECE_DIRECTIONS = {('r', False): (0, 1), ('r', True): (0, 1, 2, 3),
+                    ('b', False): (2, 3), ('b', True): (2, 3, 0, 1)}
+# Spaces where a red/black piece is promoted to a King.
+KING_ROWS = {'r': 0x0000000F, 'b': 0xF0000000}
+FULL_BOARD = 0xFFFFFFFF
+
+
+def _direction_table(player: str, king: bool) -> list[tuple]:
+    """
+    Return, for every square, a tuple of (step bit, step square, landing bit, landing square)
+    for each direction the piece may go, where the step is the adjacent space
+    (also the jumped-over space) and the landing is the space across it.
+    The landing bit is 0 (and its square is -1) when the space is off the board.
+    """
+    table = []
+    for x, y in SQUARE_POSITIONS:
+        entries = []
+        for d in PIECE_DIRECTIONS[(player, king)]:
+            dx, dy = DIRECTIONS[d]
+            step = square_mask((x + dx, y + dy))
+            if not step:
+                continue
+            landing = square_mask((x + 2 * dx, y + 2 * dy))
+            entries.append((step, step.bit_length() - 1, landing, landing.bit_length() - 1))
+        table.append(tuple(entries))
+    return table
+
+
+MOVE_TABLES = {key: _direction_table(*key) for key in PIECE_DIRECTIONS}
+
+
+def _neighbour_shifts(d: int) -> tuple:
+    """
+    Return the (shift, source mask) pairs that move every square to its neighbour in
+    direction d. The distance between a square and its neighbour depends on the parity
+    of its row, and source masks leave out the squares whose neighbour is off the board.
+    """
+    sources = {}
+    dx, dy = DIRECTIONS[d]
+    for i, (x, y) in enumerate(SQUARE_POSITIONS):
+        neighbour = square_mask((x + dx, y + dy))
+        if neighbour:
+            shift = neighbour.bit_length() - 1 - i
+            sources[shift] = sources.get(shift, 0) | 1 << i
+    return tuple(sources.items())
+
+
+NEIGHBOUR_SHIFTS = [_neighbour_shifts(d) for d in range(4)]
+# Direction pointing back the opposite way of each direction.
+OPPOSITE = [3, 2, 1, 0]
+LEFT_EDGE = sum(bit for (x, _), bit in SQUARE_MASKS.items() if x == 0)
+RIGHT_EDGE = sum(bit for (x, _), bit in SQUARE_MASKS.items() if x == 7)
+
+
+def neighbours(mask: int, d: int) -> int:
+    """Return the mask of the neighbours in direction d of the squares in mask."""
+    result = 0
+    for shift, source in NEIGHBOUR_SHIFTS[d]:
+        if shift > 0:
+            result |= (mask & source) << shift
+        else:
+            result |= (mask & source) >> -shift
+    return result
+
+# Zobrist keys: one random 64-bit number per piece and square, with the pieces
+# indexed 0 'r', 1 'R', 2 'b', 3 'B'. The key of a board is the xor of the keys
+# of its pieces, so a move only has to xor in the squares it changes.
+_zobrist_random = random.Random(384)
+ZOBRIST = [[_zobrist_random.getrandbits(64) for _ in range(32)] for _ in range(4)]
+# Keys of (own man, own King, opponent man, opponent King) for each player.
+ZOBRIST_SIDES = {'r': (ZOBRIST[0], ZOBRIST[1], ZOBRIST[2], ZOBRIST[3]),
+                 'b': (ZOBRIST[2], ZOBRIST[3], ZOBRIST[0], ZOBRIST[1])}
+# Xor-ed into the key of a board when it is black's turn.
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+
+
+def zobrist_key(red: int, black: int, kings: int) -> int:
+    """Return the Zobrist key of the board given by the red, black and kings masks."""
+    key = 0
+    for sq in squares(red):
+        key ^= ZOBRIST[kings >> sq & 1][sq]
+    for sq in squares(black):
+        key ^= ZOBRIST[2 + (kings >> sq & 1)][sq]
+    return key
+
+
+class Move(NamedTuple):
+    """
+    A move of one piece: a step, or a single or multiple capture.
+
+    Attributes:
+    origin: The position the piece starts on.
+    path: The positions the piece lands on, in order (one position for a step).
+    captured: The positions of the opponent's pieces captured, in order.
+    promotion: True if the piece becomes a King.
+    red/black/kings/zobrist: The bits (and the Zobrist key) the move changes;
+    State.apply and State.undo xor them into the board.
+    """
+    origin: tuple
+    path: tuple
+    captured: tuple
+    promotion: bool
+    red: int
+    black: int
+    kings: int
+    zobrist: int
 
 
 class State:
     """
-    This class record a state of board in dictionary.
+    This class record a state of board in bitboards.
 
     Attributes:
-    map: A dictionary stores the position of each space (treat it as coordinates) as key and
-    the corresponding value of each key is a list.
-    In the list, we store the type of piece as string at index 0 ('r' is a red piece;
-    'R' is a red king; 'b' is a black piece; 'B' is a black king; '.' means no piece on it),
-    and index 1 stores what color is that space (0 is white;
-    1 is black which only black can be occupied by a piece).
-
-    red/black: A dictionary stores the position of red/black pieces on the board
-    (position stores in coordinates form) as key,
-    and the corresponding value of each key is a string ('r' is a red piece;
-    'R' is a red king; 'b' is a black piece; 'B' is a black king).
+    red/black: A 32-bit mask of the dark spaces occupied by red/black pieces.
+    Bit i stands for the space SQUARE_POSITIONS[i] (stored in coordinates form).
+    kings: A 32-bit mask of the dark spaces occupied by a King of either color
+    ('R' is a red king; 'B' is a black king; other red/black pieces are 'r'/'b').
+    zobrist: The Zobrist key of the board, kept up to date by move().
     NOTE: Domain of coordinates: {(x, y)| 0 <= x <= 7, 0 <= y <= 7}.
 
     Method:
     - move(position: tuple, destination: tuple):
         Move the piece on the given position to destination position
         NOTE: assume we move right color piece every move, and the position is not empty.
+    - piece(position: tuple):
+        Return the piece on position as string ('.' if the space is empty).
     - display():
         print the state information (where is each piece at) as "matrix-like" form to console.
 
     """
-    # map: dict[tuple, list[str, int]]
-    red: dict[tuple, str]
-    black: dict[tuple, str]
+    __slots__ = ('red', 'black', 'kings', 'zobrist')
+    red: int
+    black: int
+    kings: int
+    zobrist: int
 
-    def __init__(self) -> None:
-        # self.red = {(7, 2): 'R', (7, 4): 'r', (3, 6): 'r'}
-        # self.black = {(4, 1): 'b', (2,  3): 'b', (4, 3): 'b', (3, 4): 'b', (4, 7): 'B'}
-        self.red = dict()
-        self.black = dict()
+    def __init__(self, red: int = 0, black: int = 0, kings: int = 0,
+                 zobrist: Optional[int] = None) -> None:
+        self.red = red
+        self.black = black
+        self.kings = kings
+        self.zobrist = zobrist_key(red, black, kings) if zobrist is None else zobrist
 
     def __str__(self) -> str:
         """
         Print the state information to console.
         """
-        # initialize the board info
-        lst = []
-        result = ''
-        for _ in range(8):
-            lst.append(['.', '.', '.', '.', '.', '.', '.', '.'])
-
-        for key in self.black:
-            lst[key[1]][key[0]] = self.black[key]
-
-        for key in self.red:
-            lst[key[1]][key[0]] = self.red[key]
-
-        for i in range(8):
-            result += ''.join(lst[i])
-            result += '\n'
-
-        return result
+        # Each row is looked up by the 4 bits of each mask it holds.
+        red, black, kings = self.red, self.black, self.kings
+        return ''.join(ROW_TEXTS[y & 1][(red >> 4 * y & 15) | (black >> 4 * y & 15) << 4
+                                        | (kings >> 4 * y & 15) << 8] for y in range(8))
 
     def __eq__(self, other):
         """
-        Return True if all items in other's red and black are same as self's
+        Return True if other has the same pieces as self on every space
         """
-        # Check whether they have same number of elements in red and black map
-        if len(self.red) != len(other.red) \
-                or len(self.black) != len(other.black):
-            return False
-
-        # Check all key and the corresponding value of that key are
-        # same in self's and other's red and black map
-        for key in self.red:
-            if key not in other.red:
-                return False
-            elif self.red[key] != other.red[key]:
-                return False
-        for key in self.black:
-            if key not in other.black:
-                return False
-            elif self.black[key] != other.black[key]:
-                return False
-        return True
+        if not isinstance(other, State):
+            return NotImplemented
+        return self.red == other.red and self.black == other.black \
+            and self.kings == other.kings
+
+    def __hash__(self):
+        """
+        Return the Zobrist key of the board. It only depends on the pieces, so it is the
+        same in every run. NOTE: do not move() a State while it is used as a dict key.
+        """
+        return self.zobrist
+
+    def piece(self, position: tuple) -> str:
+        """Return the piece on position ('r', 'R', 'b', 'B', or '.' if it is empty)."""
+        bit = square_mask(position)
+        if self.red & bit:
+            return 'R' if self.kings & bit else 'r'
+        if self.black & bit:
+            return 'B' if self.kings & bit else 'b'
+        return '.'
 
     def move(self, position: tuple, destination: tuple):
         """
@@ -95,7 +235,8 @@ class State:
         NOTE: assume we move right color piece every move, and the position is not empty.
         NOTE: We include jump in move().
         """
-        assert position in self.red or position in self.black
+        src = square_mask(position)
+        assert src & (self.red | self.black)
         assert 0 <= position[0] <= 7
         assert 0 <= position[1] <= 7
         assert 0 <= destination[0] <= 7
@@ -108,86 +249,263 @@ class State:
             # print("ERROR: not eligible diagonal move.")
             return None
 
-        if (destination not in self.red) and (destination not in self.black):
+        dst = square_mask(destination)
+        occupied = self.red | self.black
+        if not dst & occupied:
             # destination is empty, then move piece in position to destination
-            if position in self.red:
-                piece = self.red.pop(position)
-                if destination[1] == 0:
-                    self.red[destination] = 'R'
-                else:
-                    self.red[destination] = piece
-            else:
-                piece = self.black.pop(position)
-                if destination[1] == 7:
-                    self.black[destination] = 'B'
-                else:
-                    self.black[destination] = piece
+            self._relocate(src, dst, destination[1])
             return destination
 
-        # Red piece capture a black piece or nothing happen
-        # if there are no empty space across black piece
-        if position in self.red and destination in self.black:
+        # A piece capture an opponent's piece or nothing happen
+        # if there are no empty space across that piece
+        if (self.red & src and self.black & dst) or (self.black & src and self.red & dst):
             new_des = (destination[0] + x_dis, destination[1] + y_dis)
-            if 0 <= new_des[0] <= 7 and 0 <= new_des[1] <= 7 \
-                    and new_des not in self.black and new_des not in self.red:
+            landing = square_mask(new_des)
+            if landing and not landing & occupied:
                 # jump to the space that across destination
-                piece = self.red.pop(position)
-                if new_des[1] == 0:
-                    self.red[new_des] = 'R'
-                else:
-                    self.red[new_des] = piece
-                # remove the piece on destination
-                self.black.pop(destination)
-                return new_des
-
-        # Black piece capture a red piece or nothing happen
-        # if there are no empty space across red piece
-        elif position in self.black and destination in self.red:
-            new_des = (destination[0] + x_dis, destination[1] + y_dis)
-            if 0 <= new_des[0] <= 7 and 0 <= new_des[1] <= 7 \
-                    and new_des not in self.black and new_des not in self.red:
-                # jump to the space that across destination
-                piece = self.black.pop(position)
-                if new_des[1] == 7:
-                    self.black[new_des] = 'B'
-                else:
-                    self.black[new_des] = piece
+                self._relocate(src, landing, new_des[1])
                 # remove the piece on destination
-                self.red.pop(destination)
+                self.zobrist ^= ZOBRIST[self._piece_index(dst)][dst.bit_length() - 1]
+                self.red &= ~dst
+                self.black &= ~dst
+                self.kings &= ~dst
                 return new_des
         # else:
         #     print("ERROR: not eligible move: same color in position and destination")
         return None
 
+    def apply(self, move: Move) -> None:
+        """Make move (generated for this board) on this board."""
+        self.red ^= move.red
+        self.black ^= move.black
+        self.kings ^= move.kings
+        self.zobrist ^= move.zobrist
+
+    def undo(self, move: Move) -> None:
+        """Take back move, the last move applied to this board."""
+        self.red ^= move.red
+        self.black ^= move.black
+        self.kings ^= move.kings
+        self.zobrist ^= move.zobrist
+
+    def _relocate(self, src: int, dst: int, row: int) -> None:
+        """Move the piece on bit src to the empty bit dst in the given row, promoting it if needed."""
+        index = self._piece_index(src)
+        if self.red & src:
+            self.red ^= src | dst
+            promote = row == 0
+        else:
+            self.black ^= src | dst
+            promote = row == 7
+        if self.kings & src:
+            self.kings ^= src | dst
+        elif promote:
+            self.kings |= dst
+            self.zobrist ^= ZOBRIST[index][src.bit_length() - 1] ^ ZOBRIST[index + 1][dst.bit_length() - 1]
+            return
+        self.zobrist ^= ZOBRIST[index][src.bit_length() - 1] ^ ZOBRIST[index][dst.bit_length() - 1]
+
+    def _piece_index(self, bit: int) -> int:
+        """Return the index of the piece on bit in ZOBRIST. Assume the space is not empty."""
+        return (0 if self.red & bit else 2) + (1 if self.kings & bit else 0)
+
 
 def terminal(state: State) -> bool:
     """Return True if any player in play win."""
     # Check whether any player in play has no pieces.
-    if len(state.red) == 0 or len(state.black) == 0:
+    if state.red == 0 or state.black == 0:
         return True
     # Check whether any player in play cannot make a eligible move:
-    if len(expand(state, 'r')) == 0 or len(expand(state, 'b')) == 0:
+    if not has_any_move(state, 'r') or not has_any_move(state, 'b'):
         return True
     return False
 
 
+def _row_texts(parity: int) -> list[str]:
+    """
+    Return the text (with its newline) of a row of parity (row index % 2) for every code
+    red | black << 4 | kings << 8, where red, black and kings are the 4 bits of the masks
+    for the dark spaces of the row, from left to right.
+    """
+    texts = []
+    for code in range(1 << 12):
+        row = ['.'] * 8
+        for j in range(4):
+            x = 2 * j + 1 - parity
+            king = code >> 8 + j & 1
+            if code >> j & 1:
+                row[x] = 'R' if king else 'r'
+            elif code >> 4 + j & 1:
+                row[x] = 'B' if king else 'b'
+        texts.append(''.join(row) + '\n')
+    return texts
+
+
+# Text of a row by parity and code (see _row_texts), and the code of every row text
+# (without newline) that can be on a board, by parity.
+ROW_TEXTS = [_row_texts(0), _row_texts(1)]
+ROW_CODES = [{ROW_TEXTS[parity][code][:8]: code for code in range(1 << 12)
+              if not code & code >> 4 & 15 and not code >> 8 & ~(code | code >> 4) & 15}
+             for parity in (0, 1)]
+
+
 def txt_to_state(file: str) -> State:
     """Return a State that convert input form to a game board state."""
     f = open(file, 'r')
     str_lst = f.readlines()
-    result = State()
+    f.close()
+    return lines_to_state(str_lst, file)
+
+
+def lines_to_state(str_lst: list[str], name: str = '<board>') -> State:
+    """Return the State given by the first 8 lines of str_lst (name is used in error messages)."""
+    red = black = kings = 0
+    try:
+        # Each row is looked up whole; the rows not in ROW_CODES (a piece on a white space,
+        # other characters, short lines) are read one character at a time below.
+        for y in range(8):
+            code = ROW_CODES[y & 1][str_lst[y][:8]]
+            red |= (code & 15) << 4 * y
+            black |= (code >> 4 & 15) << 4 * y
+            kings |= (code >> 8) << 4 * y
+        return State(red, black, kings)
+    except KeyError:
+        red = black = kings = 0
     for y in range(8):
         for x in range(8):
-            if str_lst[y][x] == 'r':
-                result.red[(x, y)] = 'r'
-            elif str_lst[y][x] == 'R':
-                result.red[(x, y)] = 'R'
-            elif str_lst[y][x] == 'b':
-                result.black[(x, y)] = 'b'
-            elif str_lst[y][x] == 'B':
-                result.black[(x, y)] = 'B'
-    f.close()
-    return result
+            if str_lst[y][x] in 'rRbB':
+                bit = square_mask((x, y))
+                if not bit:
+                    raise ValueError(f"piece on white space {(x, y)} in {name}")
+                if str_lst[y][x] in 'rR':
+                    red |= bit
+                else:
+                    black |= bit
+                if str_lst[y][x] in 'RB':
+                    kings |= bit
+    return State(red, black, kings)
+
+
+def read_boards(source: str) -> Iterator[State]:
+    """
+    Yield, one at a time, every board in source: a directory (every file in it, sorted
+    by name), a file with boards one after another, or '-' for stdin. Each board is
+    8 lines as read by txt_to_state; blank lines between boards are skipped.
+    """
+    if source == '-':
+        yield from _boards_from_lines(sys.stdin, '<stdin>')
+    elif os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if os.path.isfile(path):
+                yield from _boards_from_file(path)
+    else:
+        yield from _boards_from_file(source)
+
+
+def _boards_from_file(path: str) -> Iterator[State]:
+    """Helper function for read_boards that reads a board file (see write_board_file) or a text file."""
+    with open(path, 'rb') as f:
+        binary = f.read(len(BOARDS_MAGIC)) == BOARDS_MAGIC
+    if binary:
+        with BoardFile(path) as boards:
+            yield from boards
+    else:
+        with open(path, 'r') as f:
+            yield from _boards_from_lines(f, path)
+
+
+def _boards_from_lines(lines: Iterable[str], name: str) -> Iterator[State]:
+    """Helper function for read_boards that groups lines into boards of 8 lines."""
+    board = []
+    for line in lines:
+        if line.strip():
+            board.append(line)
+            if len(board) == 8:
+                yield lines_to_state(board, name)
+                board = []
+    if board:
+        raise ValueError(f"{name} ends with an incomplete board of {len(board)} lines")
+
+
+# A board file is BOARDS_MAGIC followed by a record of BOARD_RECORD (red, black, kings)
+# for every board, 12 bytes each.
+BOARDS_MAGIC = b'CKBOARD1'
+BOARD_RECORD = struct.Struct('<III')
+
+
+def write_board_file(states: Iterable[State], path: str) -> int:
+    """Write every board of states to path as a board file and return the number of boards."""
+    count = 0
+    with open(path, 'wb') as f:
+        f.write(BOARDS_MAGIC)
+        pack = BOARD_RECORD.pack
+        for state in states:
+            f.write(pack(state.red, state.black, state.kings))
+            count += 1
+    return count
+
+
+def _map_file(path: str, magic: bytes, header: int, record: int, error: str) -> tuple[Any, mmap.mmap]:
+    """
+    Helper function for the classes that read a mapped file: open the file at path and map
+    it in memory for reading, and return the file and the map.
+    The file must start with magic, then header more bytes, then whole records of record
+    bytes: its size is checked before mapping (an empty file cannot be mapped), and a file
+    that is not of this form is closed and raises ValueError with error.
+    """
+    file = open(path, 'rb')
+    try:
+        size = os.fstat(file.fileno()).st_size
+        if size < len(magic) + header or (size - len(magic) - header) % record:
+            raise ValueError(error)
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except BaseException:
+        file.close()
+        raise
+    if data[:len(magic)] != magic:
+        data.close()
+        file.close()
+        raise ValueError(error)
+    return file, data
+
+
+class BoardFile:
+    """
+    The boards of a file written by write_board_file. The file is mapped in memory, so
+    nothing is read when it is opened and any board can be read by its index.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.file, self.data = _map_file(path, BOARDS_MAGIC, 0, BOARD_RECORD.size,
+                                         f"{path}: not a board file")
+        self.size = (len(self.data) - len(BOARDS_MAGIC)) // BOARD_RECORD.size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index: int) -> State:
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("board index out of range")
+        return State(*BOARD_RECORD.unpack_from(self.data, len(BOARDS_MAGIC) + index * BOARD_RECORD.size))
+
+    def __iter__(self) -> Iterator[State]:
+        unpack_from = BOARD_RECORD.unpack_from
+        for offset in range(len(BOARDS_MAGIC), len(self.data), BOARD_RECORD.size):
+            yield State(*unpack_from(self.data, offset))
+
+    def __enter__(self) -> 'BoardFile':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Unmap and close the file."""
+        self.data.close()
+        self.file.close()
 
 
 def expand(state: State, player: str) -> list[State]:
@@ -195,9 +513,12 @@ def expand(state: State, player: str) -> list[State]:
     Return all the possible successor of state.
     Assume the input of player is either 'r' or 'b' ('r' for red, 'b' for black).
     """
-    result = []
+    # Successors are kept as dict keys: membership is checked by hash and
+    # the dict keeps them in the order they were found.
+    result = {}
     if player == 'r':
-        for key in state.red:
+        for sq in squares(state.red):
+            key = SQUARE_POSITIONS[sq]
             # Clone 4 states for movement
             s1 = clone(state)
             s2 = clone(state)
@@ -209,10 +530,11 @@ def expand(state: State, player: str) -> list[State]:
             s4_lst = expand_single(s4, key, 'r')
             for i in [s1_lst, s2_lst, s3_lst, s4_lst]:
                 for s in i:
-                    if s != state and s not in result:
-                        result.append(s)
+                    if s != state:
+                        result[s] = None
     else:
-        for key in state.black:
+        for sq in squares(state.black):
+            key = SQUARE_POSITIONS[sq]
             # Clone 4 states for movement
             s1 = clone(state)
             s2 = clone(state)
@@ -224,9 +546,9 @@ def expand(state: State, player: str) -> list[State]:
             s4_lst = expand_single(s4, key, 'b')
             for i in [s1_lst, s2_lst, s3_lst, s4_lst]:
                 for s in i:
-                    if s != state and s not in result:
-                        result.append(s)
-    return result
+                    if s != state:
+                        result[s] = None
+    return list(result)
 
 
 def expand_single(state: State, position: tuple, player: str) -> list[State]:
@@ -234,17 +556,17 @@ def expand_single(state: State, position: tuple, player: str) -> list[State]:
     Return a list of State by a given position of piece.
     Assume the space at position is not empty.
     """
-    result = []
+    result = {}
     des_lst = []
     if player == 'r':
-        assert position in state.red
+        assert state.red & square_mask(position)
         # List out all the possible destination
         if 0 <= (position[0] - 1) <= 7 and 0 <= (position[1] - 1) <= 7:
             des_lst.append((position[0] - 1, position[1] - 1))
         if 0 <= (position[0] + 1) <= 7 and 0 <= (position[1] - 1) <= 7:
             des_lst.append((position[0] + 1, position[1] - 1))
 
-        if state.red[position] == 'R':
+        if state.piece(position) == 'R':
             if 0 <= (position[0] - 1) <= 7 and 0 <= (position[1] + 1) <= 7:
                 des_lst.append((position[0] - 1, position[1] + 1))
             if 0 <= (position[0] + 1) <= 7 and 0 <= (position[1] + 1) <= 7:
@@ -259,30 +581,27 @@ def expand_single(state: State, position: tuple, player: str) -> list[State]:
                 if des != curr_position:  # it means that the player had
                                           # capture his/her opponent's piece
 
-                    if state.red[position] != nxt_state.red[curr_position]:
+                    if state.piece(position) != nxt_state.piece(curr_position):
                         # Situation when the piece on curr_position promote to a King.
-                        if nxt_state not in result:
-                            result.append(nxt_state)
+                        result[nxt_state] = None
                     else:
                         multi_return = multi_jump(nxt_state, curr_position,
                                                   get_surr(nxt_state, curr_position, player),
-                                                  player, nxt_state.red[curr_position])
+                                                  player, nxt_state.piece(curr_position))
                         for s in multi_return:
-                            if s not in result:
-                                result.append(s)
+                            result[s] = None
                 else:
-                    if nxt_state not in result:
-                        result.append(nxt_state)
+                    result[nxt_state] = None
     # For the black player
     else:
-        assert position in state.black
+        assert state.black & square_mask(position)
         # List out all the possible destination
         if 0 <= (position[0] - 1) <= 7 and 0 <= (position[1] + 1) <= 7:
             des_lst.append((position[0] - 1, position[1] + 1))
         if 0 <= (position[0] + 1) <= 7 and 0 <= (position[1] + 1) <= 7:
             des_lst.append((position[0] + 1, position[1] + 1))
 
-        if state.black[position] == 'B':
+        if state.piece(position) == 'B':
             if 0 <= (position[0] - 1) <= 7 and 0 <= (position[1] - 1) <= 7:
                 des_lst.append((position[0] - 1, position[1] - 1))
             if 0 <= (position[0] + 1) <= 7 and 0 <= (position[1] - 1) <= 7:
@@ -296,28 +615,25 @@ def expand_single(state: State, position: tuple, player: str) -> list[State]:
             if nxt_state != state:
                 if des != curr_position:  # it means that the player had
                                           # capture his/her opponent's piece
-                    if state.black[position] != nxt_state.black[curr_position]:
+                    if state.piece(position) != nxt_state.piece(curr_position):
                         # Situation when the piece on curr_position promote to a King.
-                        if nxt_state not in result:
-                            result.append(nxt_state)
+                        result[nxt_state] = None
                     else:
                         multi_return = multi_jump(nxt_state, curr_position,
                                                   get_surr(nxt_state, curr_position, player),
-                                                  player, nxt_state.black[curr_position])
+                                                  player, nxt_state.piece(curr_position))
                         for s in multi_return:
-                            if s not in result:
-                                result.append(s)
+                            result[s] = None
                 else:
-                    if nxt_state not in result:
-                        result.append(nxt_state)
-    return result
+                    result[nxt_state] = None
+    return list(result)
 
 
 def multi_jump(state: State, position: tuple,
                surr: list[tuple], player: str, piece: str) -> list[State]:
     """Helper function for expand_single that check surrounding
     diagonal space of position and find where can do a multiple jump"""
-    result = []
+    result = {}
     if surr == []:
         return [state]
     else:
@@ -328,19 +644,16 @@ def multi_jump(state: State, position: tuple,
                 # Is piece at curr_pos become King?
                 if (piece == 'r' and curr_pos[1] == 0) or (piece == 'b' and curr_pos[1] == 7):
                     # Turn ends
-                    if nxt_state not in result:
-                        result.append(nxt_state)
+                    result[nxt_state] = None
                 else:
                     # Recursion for getting the final state of multiple capture
                     multi_return = multi_jump(nxt_state, curr_pos,
                                               get_surr(nxt_state, curr_pos, player), player, piece)
                     for s in multi_return:
-                        if s not in result:
-                            result.append(s)
+                        result[s] = None
             else:
-                if nxt_state not in result:
-                    result.append(nxt_state)
-        return result
+                result[nxt_state] = None
+        return list(result)
 
 
 def get_surr(state: State, position: tuple, player: str):
@@ -348,45 +661,350 @@ def get_surr(state: State, position: tuple, player: str):
     result = []
     if player == 'r':
         if 0 <= (position[0] - 1) <= 7 and 0 <= (position[1] - 1) <= 7 and \
-                (position[0] - 1, position[1] - 1) in state.black:
+                state.black & square_mask((position[0] - 1, position[1] - 1)):
             result.append((position[0] - 1, position[1] - 1))
         if 0 <= (position[0] + 1) <= 7 and 0 <= (position[1] - 1) <= 7 and \
-                (position[0] + 1, position[1] - 1) in state.black:
+                state.black & square_mask((position[0] + 1, position[1] - 1)):
             result.append((position[0] + 1, position[1] - 1))
 
-        if state.red[position] == 'R':
+        if state.piece(position) == 'R':
             if 0 <= (position[0] - 1) <= 7 and 0 <= (position[1] + 1) <= 7 and \
-                    (position[0] - 1, position[1] + 1) in state.black:
+                    state.black & square_mask((position[0] - 1, position[1] + 1)):
                 result.append((position[0] - 1, position[1] + 1))
             if 0 <= (position[0] + 1) <= 7 and 0 <= (position[1] + 1) <= 7 and \
-                    (position[0] + 1, position[1] + 1) in state.black:
+                    state.black & square_mask((position[0] + 1, position[1] + 1)):
                 result.append((position[0] + 1, position[1] + 1))
     else:
         if 0 <= (position[0] - 1) <= 7 and 0 <= (position[1] + 1) <= 7 and \
-                (position[0] - 1, position[1] + 1) in state.red:
+                state.red & square_mask((position[0] - 1, position[1] + 1)):
             result.append((position[0] - 1, position[1] + 1))
         if 0 <= (position[0] + 1) <= 7 and 0 <= (position[1] + 1) <= 7 and \
-                (position[0] + 1, position[1] + 1) in state.red:
+                state.red & square_mask((position[0] + 1, position[1] + 1)):
             result.append((position[0] + 1, position[1] + 1))
 
-        if state.black[position] == 'B':
+        if state.piece(position) == 'B':
             if 0 <= (position[0] - 1) <= 7 and 0 <= (position[1] - 1) <= 7 and \
-                    (position[0] - 1, position[1] - 1) in state.red:
+                    state.red & square_mask((position[0] - 1, position[1] - 1)):
                 result.append((position[0] - 1, position[1] - 1))
             if 0 <= (position[0] + 1) <= 7 and 0 <= (position[1] - 1) <= 7 and \
-                    (position[0] + 1, position[1] - 1) in state.red:
+                    state.red & square_mask((position[0] + 1, position[1] - 1)):
                 result.append((position[0] + 1, position[1] - 1))
     return result
 
 
+def generate_moves(state: State, player: str) -> list[Move]:
+    """
+    Table-driven version of expand(): return the moves of player leading to the same
+    successors, in the same order, as expand(). Every piece of player is visited once
+    and its steps and jumps are looked up in MOVE_TABLES, so no bounds are checked
+    and no State is built. Moves that end on the same board as an earlier move are left out.
+    Assume the input of player is either 'r' or 'b' ('r' for red, 'b' for black).
+    """
+    if player == 'r':
+        own, opp = state.red, state.black
+    else:
+        own, opp = state.black, state.red
+    kings = state.kings
+    king_row = KING_ROWS[player]
+    men_table = MOVE_TABLES[(player, False)]
+    king_table = MOVE_TABLES[(player, True)]
+    keys = ZOBRIST_SIDES[player]
+    man_keys, king_keys = keys[0], keys[1]
+    empty = ~(own | opp) & FULL_BOARD
+    red_side = player == 'r'
+    # Moves are stored by the (own, opp, kings) bits they change, which keeps the
+    # first move to each board in the order expand() would produce the board.
+    moves = {}
+    for sq in squares(own):
+        bit = 1 << sq
+        king = kings & bit
+        table = king_table if king else men_table
+        piece_keys = king_keys if king else man_keys
+        origin = SQUARE_POSITIONS[sq]
+        for step, step_sq, landing, landing_sq in table[sq]:
+            if empty & step:
+                path = (SQUARE_POSITIONS[step_sq],)
+                if king:
+                    _add_move(moves, red_side, bit | step, 0, bit | step,
+                              piece_keys[sq] ^ king_keys[step_sq], origin, path, (), False)
+                elif step & king_row:
+                    _add_move(moves, red_side, bit | step, 0, step,
+                              piece_keys[sq] ^ king_keys[step_sq], origin, path, (), True)
+                else:
+                    _add_move(moves, red_side, bit | step, 0, 0,
+                              piece_keys[sq] ^ man_keys[step_sq], origin, path, (), False)
+            elif opp & step and empty & landing:
+                _capture_moves(own, opp, kings, sq, step, step_sq, landing, landing_sq,
+                               (table, king, king_row, keys, red_side), moves)
+    moves.pop((0, 0, 0), None)
+    return list(moves.values())
+
+
+def generate_captures(state: State, player: str) -> list[Move]:
+    """
+    Return the moves of generate_moves() that capture, in the same order, without
+    looking at the steps. A capture never ends on the same board as a step, so
+    generate_captures and generate_steps together give the moves of generate_moves().
+    """
+    if not can_capture(state, player):
+        return []
+    if player == 'r':
+        own, opp = state.red, state.black
+    else:
+        own, opp = state.black, state.red
+    kings = state.kings
+    king_row = KING_ROWS[player]
+    keys = ZOBRIST_SIDES[player]
+    empty = ~(own | opp) & FULL_BOARD
+    red_side = player == 'r'
+    moves = {}
+    for sq in squares(own):
+        king = kings & (1 << sq)
+        table = MOVE_TABLES[(player, bool(king))]
+        for step, step_sq, landing, landing_sq in table[sq]:
+            if opp & step and empty & landing:
+                _capture_moves(own, opp, kings, sq, step, step_sq, landing, landing_sq,
+                               (table, king, king_row, keys, red_side), moves)
+    return list(moves.values())
+
+
+def generate_steps(state: State, player: str) -> list[Move]:
+    """Return the moves of generate_moves() that do not capture, in the same order."""
+    if player == 'r':
+        own, opp = state.red, state.black
+    else:
+        own, opp = state.black, state.red
+    kings = state.kings
+    king_row = KING_ROWS[player]
+    man_keys, king_keys = ZOBRIST_SIDES[player][:2]
+    empty = ~(own | opp) & FULL_BOARD
+    red_side = player == 'r'
+    moves = []
+    for sq in squares(own):
+        bit = 1 << sq
+        king = kings & bit
+        origin = SQUARE_POSITIONS[sq]
+        for step, step_sq, _, _ in MOVE_TABLES[(player, bool(king))][sq]:
+            if not empty & step:
+                continue
+            if king:
+                kings_d, key_d, promotion = bit | step, king_keys[sq] ^ king_keys[step_sq], False
+            elif step & king_row:
+                kings_d, key_d, promotion = step, man_keys[sq] ^ king_keys[step_sq], True
+            else:
+                kings_d, key_d, promotion = 0, man_keys[sq] ^ man_keys[step_sq], False
+            own_d = bit | step
+            red_d, black_d = (own_d, 0) if red_side else (0, own_d)
+            moves.append(Move(origin, (SQUARE_POSITIONS[step_sq],), (), promotion,
+                              red_d, black_d, kings_d, key_d))
+    return moves
+
+
+def _add_move(moves: dict, red_side: bool, own_d: int, opp_d: int, kings_d: int, key_d: int,
+              origin: tuple, path: tuple, captured: tuple, promotion: bool) -> None:
+    """Helper function for generate_moves that records a move unless its board is already reached."""
+    if (own_d, opp_d, kings_d) not in moves:
+        if red_side:
+            red_d, black_d = own_d, opp_d
+        else:
+            red_d, black_d = opp_d, own_d
+        moves[(own_d, opp_d, kings_d)] = Move(origin, path, captured, promotion,
+                                              red_d, black_d, kings_d, key_d)
+
+
+def _capture_moves(own: int, opp: int, kings: int, sq: int, step: int, step_sq: int,
+                   landing: int, landing_sq: int, piece: tuple, moves: dict) -> None:
+    """
+    Helper function for generate_moves and generate_captures that records every move
+    starting with the capture of the piece on step by the piece on square sq, landing
+    on landing. piece is (move table, is King, King row, Zobrist keys, is red) of the
+    moving piece.
+    """
+    _, king, king_row, keys, red_side = piece
+    bit = 1 << sq
+    piece_keys = keys[1] if king else keys[0]
+    origin = SQUARE_POSITIONS[sq]
+    own_d = bit | landing
+    kings_d = (step & kings) | (own_d if king else 0)
+    key_d = piece_keys[sq] ^ keys[3 if kings & step else 2][step_sq]
+    path = (SQUARE_POSITIONS[landing_sq],)
+    captured = (SQUARE_POSITIONS[step_sq],)
+    if not king and landing & king_row:
+        # Promotion to a King ends the turn.
+        _add_move(moves, red_side, own_d, step, kings_d | landing,
+                  key_d ^ keys[1][landing_sq], origin, path, captured, True)
+        return
+    _jump_moves(own ^ own_d, opp ^ step, kings ^ kings_d, landing_sq,
+                own_d, step, kings_d, key_d ^ piece_keys[landing_sq],
+                origin, path, captured, piece, moves)
+
+
+def _jump_moves(own: int, opp: int, kings: int, sq: int,
+                own_d: int, opp_d: int, kings_d: int, key_d: int,
+                origin: tuple, path: tuple, captured: tuple, piece: tuple, moves: dict) -> None:
+    """
+    Helper function for generate_moves that follows multi_jump(): record every move a
+    multiple capture can end with, continuing from the piece on square sq of the board
+    (own, opp, kings). The *_d arguments are the changes made by the captures so far,
+    and piece is (move table, is King, King row, Zobrist keys, is red) of the moving piece.
+    """
+    table, king, king_row, keys, red_side = piece
+    bit = 1 << sq
+    empty = ~(own | opp) & FULL_BOARD
+    piece_keys = keys[1] if king else keys[0]
+    surrounded = False
+    for step, step_sq, landing, landing_sq in table[sq]:
+        if not opp & step:
+            continue
+        surrounded = True
+        if empty & landing:
+            own_step = bit | landing
+            kings_step = (step & kings) | (own_step if king else 0)
+            new_key_d = key_d ^ piece_keys[sq] ^ keys[3 if kings & step else 2][step_sq]
+            new_path = path + (SQUARE_POSITIONS[landing_sq],)
+            new_captured = captured + (SQUARE_POSITIONS[step_sq],)
+            if not king and landing & king_row:
+                # Turn ends
+                _add_move(moves, red_side, own_d ^ own_step, opp_d | step,
+                          kings_d ^ kings_step ^ landing, new_key_d ^ keys[1][landing_sq],
+                          origin, new_path, new_captured, True)
+                continue
+            _jump_moves(own ^ own_step, opp ^ step, kings ^ kings_step, landing_sq,
+                        own_d ^ own_step, opp_d | step, kings_d ^ kings_step,
+                        new_key_d ^ piece_keys[landing_sq], origin, new_path, new_captured, piece, moves)
+        else:
+            _add_move(moves, red_side, own_d, opp_d, kings_d, key_d, origin, path, captured, False)
+    if not surrounded:
+        _add_move(moves, red_side, own_d, opp_d, kings_d, key_d, origin, path, captured, False)
+
+
+def has_any_move(state: State, player: str) -> bool:
+    """
+    Return True if expand(state, player) is not empty, that is if a piece of player can
+    step to an empty space or capture. Found with shifts over the bitboards, like
+    can_capture, stopping at the first direction with a move.
+    """
+    if player == 'r':
+        own, men_directions = state.red, (0, 1)
+    else:
+        own, men_directions = state.black, (2, 3)
+    empty = ~(state.red | state.black) & FULL_BOARD
+    own_kings = own & state.kings
+    for d in range(4):
+        # Pieces whose neighbour in direction d is empty
+        if neighbours(empty, OPPOSITE[d]) & (own if d in men_directions else own_kings):
+            return True
+    return can_capture(state, player)
+
+
+def can_capture(state: State, player: str) -> bool:
+    """
+    Return True if player can capture a piece, found with shifts over the bitboards
+    (see neighbours()) without visiting the pieces.
+    """
+    if player == 'r':
+        own, opp, men_directions = state.red, state.black, (0, 1)
+    else:
+        own, opp, men_directions = state.black, state.red, (2, 3)
+    empty = ~(state.red | state.black) & FULL_BOARD
+    own_kings = own & state.kings
+    for d in range(4):
+        o = OPPOSITE[d]
+        # Opponent's pieces with an empty space across them in direction d,
+        # then pieces next to them that can jump in direction d.
+        targets = opp & neighbours(empty, o)
+        jumpers = neighbours(targets, o) & (own if d in men_directions else own_kings)
+        if jumpers:
+            return True
+    return False
+
+
+def generate_successors(state: State, player: str) -> list[State]:
+    """
+    Table-driven version of expand(): return the same successors in the same order,
+    built from generate_moves().
+    """
+    return [State(state.red ^ m.red, state.black ^ m.black, state.kings ^ m.kings,
+                  state.zobrist ^ m.zobrist) for m in generate_moves(state, player)]
+
+
+def perft(state: State, player: str, depth: int, reference: bool = False) -> int:
+    """
+    Return the number of boards reached from state after depth moves, player moving first
+    (a board reached by two sequences of moves is counted twice).
+    The fast mode makes and takes back the moves of generate_moves() on a copy of state,
+    without building any State; with reference=True the boards are built by expand().
+    Both must give the same count on every board.
+    """
+    if reference:
+        return _perft_expand(state, player, depth)
+    return _perft_moves(clone(state), player, depth)
+
+
+def perft_divide(state: State, player: str, depth: int, reference: bool = False) -> dict[tuple, int]:
+    """
+    Same as perft, split by the first move: return the count of each board after the
+    first move, keyed by (red, black, kings) of that board.
+    """
+    result = {}
+    if reference:
+        for successor in expand(state, player):
+            result[(successor.red, successor.black, successor.kings)] = \
+                _perft_expand(successor, 'b' if player == 'r' else 'r', depth - 1)
+        return result
+    board = clone(state)
+    for move in generate_moves(board, player):
+        board.apply(move)
+        result[(board.red, board.black, board.kings)] = \
+            _perft_moves(board, 'b' if player == 'r' else 'r', depth - 1)
+        board.undo(move)
+    return result
+
+
+def _perft_moves(state: State, player: str, depth: int) -> int:
+    """Helper function for perft in the fast mode: the moves are made and taken back on state."""
+    if depth == 0:
+        return 1
+    moves = generate_moves(state, player)
+    if depth == 1:
+        return len(moves)
+    other = 'b' if player == 'r' else 'r'
+    count = 0
+    for move in moves:
+        state.apply(move)
+        count += _perft_moves(state, other, depth - 1)
+        state.undo(move)
+    return count
+
+
+def _perft_expand(state: State, player: str, depth: int) -> int:
+    """Helper function for perft in the reference mode."""
+    if depth == 0:
+        return 1
+    successors = expand(state, player)
+    if depth == 1:
+        return len(successors)
+    other = 'b' if player == 'r' else 'r'
+    return sum(_perft_expand(successor, other, depth - 1) for successor in successors)
+
+
+def flip(state: State) -> State:
+    """
+    Return state seen from the other side: the board turned by 180 degrees with the
+    colours swapped, so that black becomes red (moving up the board). Square i goes
+    to square 31 - i, so the bits of each mask are reversed.
+    """
+    return State(_reverse_bits(state.black), _reverse_bits(state.red), _reverse_bits(state.kings))
+
+
+def _reverse_bits(mask: int) -> int:
+    """Helper function for flip that reverses the 32 bits of mask."""
+    return int(f'{mask:032b}'[::-1], 2)
+
+
 def clone(state: State) -> State:
     """Return a same State without aliasing"""
-    c = State()
-    for key in state.red:
-        c.red[key] = state.red[key]
-    for key in state.black:
-        c.black[key] = state.black[key]
-    return c
+    return State(state.red, state.black, state.kings, state.zobrist)
 
 
 def utility(state: State) -> int:
@@ -398,18 +1016,9 @@ def utility(state: State) -> int:
         - Each piece of black piece that cannot move +2 points
         - Each piece of red piece that cannot move -2 points
     """
-    value = 0
-    for key in state.red:
-        if state.red[key] == 'r':
-            value += 1
-        else:
-            value += 2
-    for key in state.black:
-        if state.black[key] == 'b':
-            value -= 1
-        else:
-            value -= 2
-    return value
+    red_kings = (state.red & state.kings).bit_count()
+    black_kings = (state.black & state.kings).bit_count()
+    return state.red.bit_count() + red_kings - state.black.bit_count() - black_kings
 
 
 def heuristic(state: State) -> int:
@@ -425,8 +1034,9 @@ def heuristic(state: State) -> int:
           which is going to be captured next term, -2; Otherwise, vice versa).
     """
     value = 0
-    for key in state.red:
-        if state.red[key] == 'r':
+    for sq in squares(state.red):
+        key = SQUARE_POSITIONS[sq]
+        if not state.kings >> sq & 1:
             value += 1
         else:
             value += 2
@@ -436,11 +1046,11 @@ def heuristic(state: State) -> int:
             # (want to keep King as possible as we can) which +/- 1 point.
             if key[0] == 0:
                 value += 1
-                if (key[0] + 1, key[1] + 1) in state.red:
+                if state.red & square_mask((key[0] + 1, key[1] + 1)):
                     value += 1
             elif key[0] == 7:
                 value += 1
-                if (key[0] - 1, key[1] + 1) in state.red:
+                if state.red & square_mask((key[0] - 1, key[1] + 1)):
                     value += 1
             if get_surr(state, key, 'r') == []:
                 value += 2
@@ -449,37 +1059,38 @@ def heuristic(state: State) -> int:
             value -= 1
         # Find pyramid red had
         if 0 < key[0] < 7 and key[1] < 7:
-            if (key[0] - 1, key[1] + 1) in state.red and \
-                    (key[0] + 1, key[1] + 1) in state.red:
+            if state.red & square_mask((key[0] - 1, key[1] + 1)) and \
+                    state.red & square_mask((key[0] + 1, key[1] + 1)):
                 value += 1
 
         # Vertical prediction
-        if (key[0], key[0] - 2) in state.black and key[0] == 1 and 3 <= key[1]:
+        if state.black & square_mask((key[0], key[0] - 2)) and key[0] == 1 and 3 <= key[1]:
             empty_lst = [(key[0] - 1, key[0] - 1), (key[0] + 1, key[0] - 3)]
             empty = True
             for space in empty_lst:
-                if space in state.black or space in state.red:
+                if (state.black | state.red) & square_mask(space):
                     empty = False
             if empty:
-                if state.black[(key[0], key[0] - 2)] == 'b':
+                if state.piece((key[0], key[0] - 2)) == 'b':
                     value += 1
                 else:
                     value += 2
 
-        if (key[0], key[0] - 2) in state.black and key[0] == 6 and 3 <= key[1]:
+        if state.black & square_mask((key[0], key[0] - 2)) and key[0] == 6 and 3 <= key[1]:
             empty_lst = [(key[0] + 1, key[0] - 1), (key[0] - 1, key[0] - 3)]
             empty = True
             for space in empty_lst:
-                if space in state.black or space in state.red:
+                if (state.black | state.red) & square_mask(space):
                     empty = False
             if empty:
-                if state.black[(key[0], key[0] - 2)] == 'b':
+                if state.piece((key[0], key[0] - 2)) == 'b':
                     value += 1
                 else:
                     value += 2
 
-    for key in state.black:
-        if state.black[key] == 'b':
+    for sq in squares(state.black):
+        key = SQUARE_POSITIONS[sq]
+        if not state.kings >> sq & 1:
             value -= 1
         else:
             value -= 2
@@ -487,11 +1098,11 @@ def heuristic(state: State) -> int:
             # the piece beside it also count a pyramid.
             if key[0] == 0:
                 value -= 1
-                if (key[0] + 1, key[1] - 1) in state.black:
+                if state.black & square_mask((key[0] + 1, key[1] - 1)):
                     value -= 1
             elif key[0] == 7:
                 value -= 1
-                if (key[0] - 1, key[1] - 1) in state.black:
+                if state.black & square_mask((key[0] - 1, key[1] - 1)):
                     value -= 1
             if get_surr(state, key, 'b') == []:
                 value -= 2
@@ -500,90 +1111,1525 @@ def heuristic(state: State) -> int:
             value += 1
         # Find pyramid red had
         if 0 < key[0] < 7 and 0 < key[1]:
-            if (key[0] - 1, key[1] - 1) in state.black and \
-                    (key[0] + 1, key[1] - 1) in state.black:
+            if state.black & square_mask((key[0] - 1, key[1] - 1)) and \
+                    state.black & square_mask((key[0] + 1, key[1] - 1)):
                 value -= 1
 
     return value
 
 
-def ab_search(state: State, d_limit: int) -> State:
-    """Minimax search with alpha-beta pruning"""
-    best_move, _ = max_value(state, -math.inf, math.inf, d_limit)
+def evaluate(state: State) -> int:
+    """
+    Return the same value as heuristic(state), computed for all pieces at once.
+    Every term of heuristic only looks at the diagonal neighbours of a piece and the
+    spaces across them, so each term is a fixed number of shifts and masks over the
+    bitboards (see neighbours()) whatever the number of pieces, and no successor is built.
+    NOTE: the vertical prediction of heuristic never applies (it looks at (1, -1) and at
+    the white space (6, 4)), so it has no term here.
+    """
+    red, black, kings = state.red, state.black, state.kings
+    empty = ~(red | black) & FULL_BOARD
+    # back[d][m]: squares whose neighbour in direction d is in m.
+    red_mobile = black_mobile = red_threat = black_threat = 0
+    back = []
+    for d in range(4):
+        o = OPPOSITE[d]
+        to_empty = neighbours(empty, o)
+        back.append((neighbours(red, o), neighbours(black, o)))
+        # A piece can move in direction d if the neighbour is empty, or if it is an
+        # opponent's piece with an empty space across it.
+        red_dir = to_empty | neighbours(black & to_empty, o)
+        black_dir = to_empty | neighbours(red & to_empty, o)
+        if d < 2:
+            red_mobile |= red_dir & red
+            black_mobile |= black_dir & black & kings
+        else:
+            red_mobile |= red_dir & red & kings
+            black_mobile |= black_dir & black
+        red_threat |= back[d][1]
+        black_threat |= back[d][0]
+
+    red_kings = red & kings
+    black_kings = black & kings
+    value = red.bit_count() + red_kings.bit_count() \
+        - black.bit_count() - black_kings.bit_count()
+    # Kings on the edge, and pyramids headed by them
+    value += (red_kings & (LEFT_EDGE | RIGHT_EDGE)).bit_count() \
+        + (red_kings & LEFT_EDGE & back[3][0]).bit_count() \
+        + (red_kings & RIGHT_EDGE & back[2][0]).bit_count()
+    value -= (black_kings & (LEFT_EDGE | RIGHT_EDGE)).bit_count() \
+        + (black_kings & LEFT_EDGE & back[1][1]).bit_count() \
+        + (black_kings & RIGHT_EDGE & back[0][1]).bit_count()
+    # Kings with no opponent's piece around
+    value += 2 * (red_kings & ~red_threat).bit_count() \
+        - 2 * (black_kings & ~black_threat).bit_count()
+    # Pieces that cannot move
+    value -= (red & ~red_mobile).bit_count()
+    value += (black & ~black_mobile).bit_count()
+    # Pyramids
+    value += (red & back[2][0] & back[3][0]).bit_count()
+    value -= (black & back[0][1] & back[1][1]).bit_count()
+    return value
+
+
+def evaluate_batch(states: list[State]) -> list[int]:
+    """
+    Return [evaluate(state) for state in states] (the same values as heuristic), computed
+    for all the boards at once: the red, black and King bitboards of the boards are packed
+    into NumPy arrays and each term of evaluate() is a few operations over whole arrays.
+    The NumPy calls cost more than evaluate() on a few boards, so it pays off for long lists
+    only; the search, which orders the few moves of a node, calls evaluate(). Without NumPy, evaluate() is called on each board.
+    """
+    if np is None:
+        return [evaluate(state) for state in states]
+    count = len(states)
+    red = np.fromiter((state.red for state in states), dtype=np.uint32, count=count)
+    black = np.fromiter((state.black for state in states), dtype=np.uint32, count=count)
+    kings = np.fromiter((state.kings for state in states), dtype=np.uint32, count=count)
+    empty = ~(red | black)
+    red_mobile = np.zeros(count, dtype=np.uint32)
+    black_mobile = np.zeros(count, dtype=np.uint32)
+    red_threat = np.zeros(count, dtype=np.uint32)
+    black_threat = np.zeros(count, dtype=np.uint32)
+    back = []
+    for d in range(4):
+        o = OPPOSITE[d]
+        to_empty = _neighbours_array(empty, o)
+        back.append((_neighbours_array(red, o), _neighbours_array(black, o)))
+        red_dir = to_empty | _neighbours_array(black & to_empty, o)
+        black_dir = to_empty | _neighbours_array(red & to_empty, o)
+        if d < 2:
+            red_mobile |= red_dir & red
+            black_mobile |= black_dir & black & kings
+        else:
+            red_mobile |= red_dir & red & kings
+            black_mobile |= black_dir & black
+        red_threat |= back[d][1]
+        black_threat |= back[d][0]
+
+    red_kings = red & kings
+    black_kings = black & kings
+    edges = np.uint32(LEFT_EDGE | RIGHT_EDGE)
+    left_edge, right_edge = np.uint32(LEFT_EDGE), np.uint32(RIGHT_EDGE)
+    value = _popcount_array(red) + _popcount_array(red_kings) \
+        - _popcount_array(black) - _popcount_array(black_kings)
+    # Kings on the edge, and pyramids headed by them
+    value += _popcount_array(red_kings & edges) \
+        + _popcount_array(red_kings & left_edge & back[3][0]) \
+        + _popcount_array(red_kings & right_edge & back[2][0])
+    value -= _popcount_array(black_kings & edges) \
+        + _popcount_array(black_kings & left_edge & back[1][1]) \
+        + _popcount_array(black_kings & right_edge & back[0][1])
+    # Kings with no opponent's piece around
+    value += 2 * _popcount_array(red_kings & ~red_threat) \
+        - 2 * _popcount_array(black_kings & ~black_threat)
+    # Pieces that cannot move
+    value -= _popcount_array(red & ~red_mobile)
+    value += _popcount_array(black & ~black_mobile)
+    # Pyramids
+    value += _popcount_array(red & back[2][0] & back[3][0])
+    value -= _popcount_array(black & back[0][1] & back[1][1])
+    return value.tolist()
+
+
+def _neighbours_array(masks, d: int):
+    """Same as neighbours() for a NumPy array of masks."""
+    result = np.zeros_like(masks)
+    for shift, source in NEIGHBOUR_SHIFTS[d]:
+        if shift > 0:
+            result |= (masks & np.uint32(source)) << np.uint32(shift)
+        else:
+            result |= (masks & np.uint32(source)) >> np.uint32(-shift)
+    return result
+
+
+def _popcount_array(masks):
+    """Return the number of bits set in each mask of a NumPy array of 32-bit masks, as int64."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(masks).astype(np.int64)
+    masks = masks - ((masks >> np.uint32(1)) & np.uint32(0x55555555))
+    masks = (masks & np.uint32(0x33333333)) + ((masks >> np.uint32(2)) & np.uint32(0x33333333))
+    masks = (masks + (masks >> np.uint32(4))) & np.uint32(0x0F0F0F0F)
+    return ((masks * np.uint32(0x01010101)) >> np.uint32(24)).astype(np.int64)
+
+
+# Bound types of a transposition table entry: the stored score is the exact
+# minimax value, a lower bound of it (search failed high) or an upper bound
+# of it (search failed low).
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class TableEntry(NamedTuple):
+    """A search result stored in a TranspositionTable."""
+    key: int
+    depth: int
+    score: float
+    bound: int
+    best: Optional[Move]
+    age: int
+
+
+class TranspositionTable:
+    """
+    A bounded table of search results keyed by the Zobrist key of a board
+    (xor-ed with ZOBRIST_BLACK_TO_MOVE on black's turn).
+
+    Attributes:
+    entries: A list of size slots (size is a power of 2); a key is stored in
+    slot key & (size - 1), so each lookup is a single index.
+    age: Number of searches started with this table. When two keys share a slot
+    the deeper result is kept, unless the older entry was stored by an earlier search.
+    probes/hits/stores: Number of lookups, lookups that found the key, and stores.
+    """
+    entries: list[Optional[TableEntry]]
+    age: int
+
+    def __init__(self, size: int = 1 << 18) -> None:
+        if size <= 0 or size & (size - 1):
+            raise ValueError(f"table size must be a power of 2, got {size}")
+        self.entries = [None] * size
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def new_search(self) -> None:
+        """Mark every entry stored so far as belonging to an earlier search."""
+        self.age += 1
+
+    def probe(self, key: int) -> Optional[TableEntry]:
+        """Return the entry stored for key, or None if there is none."""
+        self.probes += 1
+        entry = self.entries[key & (len(self.entries) - 1)]
+        if entry is not None and entry.key == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key: int, depth: int, score: float, bound: int, best: Optional[Move]) -> None:
+        """Store a search result for key, following the depth-preferred replacement policy."""
+        index = key & (len(self.entries) - 1)
+        old = self.entries[index]
+        if old is None or old.age != self.age or depth >= old.depth:
+            self.entries[index] = TableEntry(key, depth, score, bound, best, self.age)
+            self.stores += 1
+
+    def principal_variation(self, state: State, depth: int) -> dict[int, Move]:
+        """
+        Return the principal variation of a search from state (red to move) as a dict
+        that maps the key of each board on it to the move the table says to make.
+        Follows at most depth moves and does not count as probes.
+        """
+        pv = {}
+        board = clone(state)
+        key = board.zobrist
+        for ply in range(depth):
+            entry = self.entries[key & (len(self.entries) - 1)]
+            if entry is None or entry.key != key or entry.best is None or key in pv:
+                break
+            pv[key] = entry.best
+            board.apply(entry.best)
+            key = board.zobrist
+            if ply % 2 == 0:
+                key ^= ZOBRIST_BLACK_TO_MOVE
+        return pv
+
+
+class SearchTimeout(Exception):
+    """Raised inside a search when the time budget of ab_search has run out (or it is stopped)."""
+
+
+@dataclass
+class DepthStats:
+    """
+    Counters and timings of the nodes searched at one remaining depth.
+
+    Attributes:
+    nodes: Number of nodes searched.
+    table_cutoffs: Number of nodes whose value was taken from the transposition table.
+    expanded: Number of nodes whose moves were generated.
+    moves: Number of moves generated.
+    cutoffs: Number of nodes left before their last move by alpha-beta pruning.
+    cutoff_index: For each index in the ordered moves, number of cutoffs made by that move.
+    times: Seconds spent in each phase: 'terminal' (terminal()), 'generate'
+    (generate_moves(), generate_captures() and generate_steps()), 'order' (rearrange_moves())
+    and 'evaluate' (evaluate() at the leaves).
+    """
+    nodes: int = 0
+    table_cutoffs: int = 0
+    expanded: int = 0
+    moves: int = 0
+    cutoffs: int = 0
+    cutoff_index: dict[int, int] = field(default_factory=dict)
+    times: dict[str, float] = field(default_factory=dict)
+
+    def timed(self, phase: str, function, *args):
+        """Return function(*args), adding the time it takes to phase."""
+        start = time.perf_counter()
+        result = function(*args)
+        self.times[phase] = self.times.get(phase, 0.0) + time.perf_counter() - start
+        return result
+
+    def cutoff(self, index: int) -> None:
+        """Record a cutoff made by the move at index of the ordered moves."""
+        self.cutoffs += 1
+        self.cutoff_index[index] = self.cutoff_index.get(index, 0) + 1
+
+
+class SearchStats:
+    """
+    Statistics of the nodes searched by max_value and min_value, collected when a
+    SearchStats is given as SearchContext.stats (a search without one pays only a check
+    per node).
+
+    Attributes:
+    depths: DepthStats for each remaining depth (0 for the leaves).
+    """
+    depths: dict[int, DepthStats]
+
+    def __init__(self) -> None:
+        self.depths = {}
+
+    def at(self, depth: int) -> DepthStats:
+        """Return the DepthStats of the nodes at remaining depth depth."""
+        stats = self.depths.get(depth)
+        if stats is None:
+            stats = self.depths[depth] = DepthStats()
+        return stats
+
+    def to_dict(self) -> dict:
+        """
+        Return the statistics as a dict that can be written as JSON: the counters of each
+        depth with the cutoff rate (cutoffs per expanded node), the rate of cutoffs made by
+        the first move and the average number of moves, and the totals of all depths.
+        """
+        result = {'depths': {}}
+        total = DepthStats()
+        for depth in sorted(self.depths, reverse=True):
+            stats = self.depths[depth]
+            result['depths'][str(depth)] = _depth_stats_dict(stats)
+            total.nodes += stats.nodes
+            total.table_cutoffs += stats.table_cutoffs
+            total.expanded += stats.expanded
+            total.moves += stats.moves
+            total.cutoffs += stats.cutoffs
+            for index, count in stats.cutoff_index.items():
+                total.cutoff_index[index] = total.cutoff_index.get(index, 0) + count
+            for phase, seconds in stats.times.items():
+                total.times[phase] = total.times.get(phase, 0.0) + seconds
+        result['total'] = _depth_stats_dict(total)
+        return result
+
+    def dump(self, file) -> None:
+        """Write the statistics to the open text file as JSON."""
+        json.dump(self.to_dict(), file, indent=2)
+        file.write('\n')
+
+
+def _depth_stats_dict(stats: DepthStats) -> dict:
+    """Helper function for SearchStats.to_dict that adds the rates to the counters of stats."""
+    result = asdict(stats)
+    result['cutoff_index'] = {str(i): n for i, n in sorted(stats.cutoff_index.items())}
+    result['cutoff_rate'] = stats.cutoffs / stats.expanded if stats.expanded else 0.0
+    result['first_move_cutoff_rate'] = stats.cutoff_index.get(0, 0) / stats.cutoffs \
+        if stats.cutoffs else 0.0
+    result['branching'] = stats.moves / stats.expanded if stats.expanded else 0.0
+    return result
+
+
+@dataclass
+class SearchContext:
+    """
+    Optional data shared by every node of one ab_search.
+
+    Attributes:
+    table: A TranspositionTable probed and updated at every node (None to disable it).
+    nodes: Number of nodes searched by max_value and min_value.
+    table_cutoffs: Number of nodes whose value was taken from the table instead of searched.
+    deadline: time.perf_counter() value at which the search raises SearchTimeout (None for no limit).
+    pv: Principal variation of the last completed iteration, as returned by
+    TranspositionTable.principal_variation; its moves are searched first.
+    depth: Deepest iteration completed by iterative deepening.
+    stats: SearchStats collecting node counts and timings (None to disable them).
+    quiescence: If True, the leaves are searched further with captures only (see quiesce_max).
+    root: Depth the current search started with; a node with d_limit left is root - d_limit
+    plies from the root.
+    sort_plies: Number of plies from the root where the moves are sorted by the heuristic
+    value after them (rearrange_moves); deeper, staged_moves uses captures, killer moves and
+    history scores instead. None sorts by heuristic value at every node.
+    killers: For each ply, the last (at most 2) moves without capture that made a cutoff.
+    history: For each move without capture (by its Zobrist change), the sum of d_limit ** 2
+    over the cutoffs it made.
+    tablebase: A Tablebase giving the value of the boards with few pieces below the root
+    (None to disable it). The boards where the game is over are then valued on the same
+    scale (see Tablebase.end_value) instead of by utility().
+    tablebase_hits: Number of nodes whose value was taken from the tablebase.
+    engine: 'alphabeta', or 'pvs' for principal variation search: every move after the first
+    of a node is searched with a null window, and again with the full window only if it
+    may be better. Iterative deepening then also starts each depth with an aspiration
+    window around the value of the previous depth. Both give the same value and move.
+    evaluator: Value of the leaves where red is to move (evaluate, or utility to count
+    the pieces only).
+    persistent: If True, new_search keeps the killer moves and history scores, for a game
+    that searches its next board with what it learned on the previous ones.
+    stop: Set to True (from another thread) to stop a search that has a deadline: it raises
+    SearchTimeout at its next node, as if the time had run out.
+    """
+    table: Optional[TranspositionTable] = None
+    nodes: int = 0
+    table_cutoffs: int = 0
+    deadline: Optional[float] = None
+    pv: dict[int, Move] = field(default_factory=dict)
+    depth: int = 0
+    stats: Optional[SearchStats] = None
+    quiescence: bool = False
+    root: int = 0
+    sort_plies: Optional[int] = 1
+    killers: dict[int, list[Move]] = field(default_factory=dict)
+    history: dict[int, int] = field(default_factory=dict)
+    tablebase: Optional['Tablebase'] = None
+    tablebase_hits: int = 0
+    engine: str = 'alphabeta'
+    evaluator: Callable[[State], int] = evaluate
+    persistent: bool = False
+    stop: bool = False
+
+    def new_search(self, d_limit: int) -> None:
+        """
+        Start a search of a new board to depth d_limit: forget the killer moves and
+        history scores (unless persistent).
+        """
+        self.root = d_limit
+        if not self.persistent:
+            self.killers.clear()
+            self.history.clear()
+
+
+def ab_search(state: State, d_limit: int, context: Optional[SearchContext] = None,
+              time_limit: Optional[float] = None) -> State:
+    """
+    Minimax search with alpha-beta pruning. Return the board after the best move of red
+    (use search_move to also get the move itself).
+    If context has a transposition table, positions already searched to the same depth
+    are not searched again. Only entries of the same remaining depth are used as results,
+    and at the root only entries of this search, so the returned move is the same as without
+    the table, even one kept from other searches.
+    If time_limit (in seconds) is given, search with iterative deepening instead:
+    d_limit is then the deepest depth tried.
+    """
+    return search_move(state, d_limit, context, time_limit)[1]
+
+
+def search_move(state: State, d_limit: int, context: Optional[SearchContext] = None,
+                time_limit: Optional[float] = None) -> tuple[Optional[Move], Optional[State]]:
+    """
+    Same as ab_search, but return both the best Move of red and the board after it
+    ((None, None) if the game is over). The search makes and takes back moves on one
+    copy of state, so state itself is left unchanged.
+    """
+    if time_limit is not None:
+        best_move = iterative_deepening(state, d_limit, time_limit, context)
+    else:
+        if context is not None:
+            context.new_search(d_limit)
+            if context.table is not None:
+                context.table.new_search()
+        best_move, _ = max_value(clone(state), -math.inf, math.inf, d_limit, context)
+    if best_move is None:
+        return None, None
+    result = clone(state)
+    result.apply(best_move)
+    return best_move, result
+
+
+# Set in each worker process of parallel_search_move (by _init_search_worker)
+# and of solve_boards (by _init_batch_worker).
+_shared_alpha = None
+_worker_context = None
+_batch_table = None
+_batch_options = None
+
+
+def parallel_search_move(state: State, d_limit: int, workers: int,
+                         context: Optional[SearchContext] = None) -> tuple[Optional[Move], Optional[State]]:
+    """
+    Same as search_move without a time limit, with the moves of red at the root
+    searched by a pool of worker processes (Young Brothers Wait at the root).
+    The first move is searched alone, and its value is the alpha bound shared by the
+    workers for the other moves; every exact value a worker finds raises the bound
+    for the moves that have not been started yet.
+    The searches are made with a strict window, so a move whose value equals the bound is
+    still searched exactly, and the best move is the first move of the best value in the
+    same order as the serial search: it is always the move search_move returns.
+    """
+    board = clone(state)
+    if workers <= 1 or d_limit < 1 or terminal(board):
+        return search_move(state, d_limit, context)
+    if context is None:
+        context = SearchContext(TranspositionTable())
+    context.new_search(d_limit)
+    if context.table is not None:
+        context.table.new_search()
+    context.nodes += 1
+    moves = rearrange_moves(board, generate_moves(board, 'r'), True)
+    values = [None] * len(moves)
+    # The eldest brother is searched first to give a bound to the others.
+    board.apply(moves[0])
+    _, values[0] = min_value(board, -math.inf, math.inf, d_limit - 1, context)
+    board.undo(moves[0])
+    alpha = multiprocessing.Value('d', values[0])
+    with ProcessPoolExecutor(workers, initializer=_init_search_worker,
+                             initargs=(alpha, _worker_options(context))) as pool:
+        futures = {pool.submit(_search_root_move, (board.red, board.black, board.kings), move, d_limit): i
+                   for i, move in enumerate(moves[1:], 1)}
+        for future in as_completed(futures):
+            bound, value, nodes = future.result()
+            context.nodes += nodes
+            # A value below the bound it was searched with is only an upper bound,
+            # and that move is worse than the move that set the bound.
+            if value >= bound:
+                values[futures[future]] = value
+    best = max((i for i in range(len(moves)) if values[i] is not None), key=lambda i: (values[i], -i))
+    board.apply(moves[best])
+    return moves[best], board
+
+
+def _init_search_worker(alpha, options: dict) -> None:
+    """
+    Initialize a worker process of parallel_search_move with the shared alpha bound
+    and a SearchContext made with options (see _worker_options).
+    """
+    global _shared_alpha, _worker_context
+    _shared_alpha = alpha
+    _worker_context = SearchContext(TranspositionTable(), **options)
+
+
+def _worker_options(context: SearchContext) -> dict:
+    """Return the options of context that the SearchContext of a worker process gets."""
+    return {'quiescence': context.quiescence, 'tablebase': context.tablebase, 'engine': context.engine,
+            'evaluator': context.evaluator}
+
+
+def _search_root_move(board: tuple, move: Move, d_limit: int) -> tuple[float, float, int]:
+    """
+    Search move, made on the board given as (red, black, kings), in a worker of
+    parallel_search_move. Return the bound used, the value found and the number of nodes.
+    The worker keeps its transposition table between moves.
+    """
+    state = State(*board)
+    state.apply(move)
+    bound = _shared_alpha.value
+    nodes = _worker_context.nodes
+    # The killer moves and history scores are kept between the moves of the root.
+    _worker_context.root = d_limit
+    _, value = min_value(state, bound, math.inf, d_limit - 1, _worker_context)
+    if value >= bound:
+        with _shared_alpha.get_lock():
+            if value > _shared_alpha.value:
+                _shared_alpha.value = value
+    return bound, value, _worker_context.nodes - nodes
+
+
+def solve_boards(states: Iterable[State], d_limit: int, time_limit: Optional[float] = None,
+                 workers: int = 1, stats: Optional[SearchStats] = None, quiescence: bool = False,
+                 book: Optional['PositionBook'] = None, tablebase: Optional['Tablebase'] = None,
+                 engine: str = 'alphabeta') -> Iterator[tuple[State, Optional[State]]]:
+    """
+    Search every board of states as ab_search does and yield (board, board after the best
+    move) pairs in the order of states (the second board is None if the game is over).
+    States are read and results yielded as the search goes, so input and output can be
+    streams. With workers > 1, boards are searched by a pool of worker processes, at most
+    2 * workers boards at a time. The transposition table is kept from one board to the next
+    (in each worker), since its entries hold whatever board they come from; each board gets
+    a new SearchContext around it, and max_value ignores the entries of earlier searches at
+    the root, so a board gets the same answer as from the command line without --batch.
+    stats collects the statistics of all boards; it is only used without workers.
+    quiescence, tablebase and engine are the options of the SearchContext of the searches.
+    The boards found in book (searched to d_limit or deeper; to any depth with time_limit)
+    are not searched again.
+    """
+    book_depth = d_limit if time_limit is None else 0
+    options = {'quiescence': quiescence, 'tablebase': tablebase, 'engine': engine}
+    if workers <= 1:
+        table = TranspositionTable()
+        for state in states:
+            result = None if book is None else book.best_board(state, book_depth, quiescence, engine)
+            if result is None:
+                context = SearchContext(table, stats=stats, **options)
+                result = ab_search(state, d_limit, context, time_limit)
+            yield state, result
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_batch_worker, initargs=(options,)) as pool:
+        pending = deque()
+        for state in states:
+            result = None if book is None else book.best_board(state, book_depth, quiescence, engine)
+            if result is not None:
+                future = Future()
+                future.set_result((result.red, result.black, result.kings))
+            else:
+                future = pool.submit(_solve_board, (state.red, state.black, state.kings),
+                                     d_limit, time_limit)
+            pending.append((state, future))
+            if len(pending) >= 2 * workers:
+                state, future = pending.popleft()
+                yield state, _result_state(future.result())
+        while pending:
+            state, future = pending.popleft()
+            yield state, _result_state(future.result())
+
+
+def _init_batch_worker(options: dict) -> None:
+    """
+    Initialize a worker process of solve_boards with its own transposition table, and the
+    options of its SearchContexts.
+    """
+    global _batch_table, _batch_options
+    _batch_table = TranspositionTable()
+    _batch_options = options
+
+
+def _solve_board(board: tuple, d_limit: int, time_limit: Optional[float]) -> Optional[tuple]:
+    """
+    Search the board given as (red, black, kings) in a worker of solve_boards and
+    return the board after the best move the same way (None if the game is over).
+    """
+    context = SearchContext(_batch_table, **_batch_options)
+    result = ab_search(State(*board), d_limit, context, time_limit)
+    return None if result is None else (result.red, result.black, result.kings)
+
+
+def _result_state(board: Optional[tuple]) -> Optional[State]:
+    """Helper function for solve_boards that turns a result of _solve_board back into a State."""
+    return None if board is None else State(*board)
+
+
+# A position book file is BOOK_MAGIC, a BOOK_HEADER with the options of the searches
+# (quiescence, and the engine name padded with zeros), then records of BOOK_RECORD sorted
+# by key: the Zobrist key of a board (red to move), the board after the best move of red
+# (red, black, kings), the value of the board and the depth it was searched to.
+# Keys come from zobrist_key(), so a book is only valid with the same ZOBRIST keys.
+BOOK_MAGIC = b'CKBOOK02'
+BOOK_HEADER = struct.Struct('<?15s')
+BOOK_RECORD = struct.Struct('<QIIIhH')
+BOOK_START = len(BOOK_MAGIC) + BOOK_HEADER.size
+
+
+class BookEntry(NamedTuple):
+    """A record of a PositionBook."""
+    key: int
+    red: int
+    black: int
+    kings: int
+    score: int
+    depth: int
+
+
+class PositionBook:
+    """
+    A book of searched boards, read from a file written by build_book. The file is mapped
+    in memory and searched by binary search on the keys, so nothing is read when it is
+    opened and a lookup only touches the records it compares.
+
+    Attributes:
+    quiescence: Whether the boards were searched with quiescence search.
+    engine: Engine the boards were searched with (see SearchContext.engine).
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file, self.data = _map_file(path, BOOK_MAGIC, BOOK_HEADER.size, BOOK_RECORD.size,
+                                         f"{path}: not a position book")
+        quiescence, engine = BOOK_HEADER.unpack_from(self.data, len(BOOK_MAGIC))
+        self.quiescence = quiescence
+        self.engine = engine.rstrip(b'\0').decode('ascii', 'replace')
+        self.size = (len(self.data) - BOOK_START) // BOOK_RECORD.size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __enter__(self) -> 'PositionBook':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Unmap and close the file."""
+        self.data.close()
+        self.file.close()
+
+    def probe(self, state: State) -> Optional[BookEntry]:
+        """Return the entry of state (red to move), or None if it is not in the book."""
+        key = state.zobrist
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if BOOK_RECORD.unpack_from(self.data, BOOK_START + middle * BOOK_RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.size:
+            entry = BookEntry(*BOOK_RECORD.unpack_from(self.data, BOOK_START + low * BOOK_RECORD.size))
+            if entry.key == key:
+                return entry
+        return None
+
+    def check(self, quiescence: bool, engine: str) -> None:
+        """
+        Raise ValueError if the boards of the book were not searched with these options:
+        its values and moves would not be those of the search they stand in for.
+        """
+        if (self.quiescence, self.engine) != (quiescence, engine):
+            raise ValueError(f"{self.path}: position book built with engine {self.engine}"
+                             f"{' and quiescence' if self.quiescence else ''}, not with engine {engine}"
+                             f"{' and quiescence' if quiescence else ''}")
+
+    def best_board(self, state: State, d_limit: int, quiescence: bool = False,
+                   engine: str = 'alphabeta') -> Optional[State]:
+        """
+        Return the board after the best move of red on state if the book has it from a
+        search to d_limit or deeper, else None. The board must be a successor of state,
+        which keeps a key collision from giving a wrong move. quiescence and engine are
+        the options of the search asking; a book built with others raises ValueError.
+        """
+        self.check(quiescence, engine)
+        entry = self.probe(state)
+        if entry is None or entry.depth < d_limit:
+            return None
+        for move in generate_moves(state, 'r'):
+            if (state.red ^ move.red, state.black ^ move.black, state.kings ^ move.kings) \
+                    == (entry.red, entry.black, entry.kings):
+                result = clone(state)
+                result.apply(move)
+                return result
+        return None
+
+
+def build_book(states: Iterable[State], d_limit: int, path: str, workers: int = 1,
+               quiescence: bool = False, engine: str = 'alphabeta') -> int:
+    """
+    Search every board of states to d_limit (as ab_search does with a new SearchContext
+    with quiescence and engine) and write the results as a position book to path. A board
+    found more than once is written once, and a board with no move is left out. With
+    workers > 1, boards are searched by a pool of worker processes. Return the number of
+    boards in the book.
+    """
+    boards = ((state.red, state.black, state.kings) for state in states)
+    if workers <= 1:
+        records = [_book_record(board, d_limit, quiescence, engine) for board in boards]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            records = list(pool.map(_book_record, boards, repeat(d_limit), repeat(quiescence),
+                                    repeat(engine), chunksize=16))
+    entries = {}
+    for record in records:
+        if record is not None:
+            entries[record.key] = record
+    with open(path, 'wb') as f:
+        f.write(BOOK_MAGIC)
+        f.write(BOOK_HEADER.pack(quiescence, engine.encode('ascii')))
+        for key in sorted(entries):
+            f.write(BOOK_RECORD.pack(*entries[key]))
+    return len(entries)
+
+
+def _book_record(board: tuple, d_limit: int, quiescence: bool, engine: str) -> Optional[BookEntry]:
+    """
+    Helper function for build_book that searches the board given as (red, black, kings)
+    and returns its BookEntry (None if the game is over). Each board gets a new
+    transposition table: a table kept from other boards can pick another move of
+    the same value, and the book would depend on the order of the boards.
+    """
+    state = State(*board)
+    context = SearchContext(TranspositionTable(), quiescence=quiescence, engine=engine)
+    context.new_search(d_limit)
+    move, value = max_value(clone(state), -math.inf, math.inf, d_limit, context)
+    if move is None:
+        return None
+    # Values are small piece counts, clamped to the 16 bits of a record.
+    score = max(-32768, min(32767, int(value)))
+    return BookEntry(state.zobrist, state.red ^ move.red, state.black ^ move.black,
+                     state.kings ^ move.kings, score, d_limit)
+
+
+# An endgame tablebase file is TABLEBASE_MAGIC, the largest number of pieces as a 32-bit
+# integer, then a 16-bit code for every board of at most that many pieces (both players
+# having pieces) and player to move, at the index given by _tablebase_index:
+# 0 for a draw, 1 + 2 * d if the player to move wins in d plies, 2 + 2 * d if it loses
+# in d plies, and TABLEBASE_INVALID for a board that cannot happen (a man on the row
+# where it would have been promoted).
+TABLEBASE_MAGIC = b'CKTBASE1'
+TABLEBASE_INVALID = 0xFFFF
+# Value of a board won in 0 plies; a board won in d plies is worth TABLEBASE_WIN - d,
+# far above any value of evaluate() or utility().
+TABLEBASE_WIN = 1000
+# BINOMIAL[n][k] is n choose k, for the ranks of sets of squares.
+BINOMIAL = [[math.comb(n, k) for k in range(33)] for n in range(33)]
+
+
+def _tablebase_offsets(pieces: int) -> dict[tuple, int]:
+    """
+    Return the index of the first board of each (red count, black count) in a tablebase of
+    at most pieces pieces, and the total number of boards under the key 'size'.
+    """
+    offsets = {}
+    size = 0
+    for count in range(2, pieces + 1):
+        for red_count in range(1, count):
+            black_count = count - red_count
+            offsets[(red_count, black_count)] = size
+            size += BINOMIAL[32][red_count] * BINOMIAL[32 - red_count][black_count] << count + 1
+    offsets['size'] = size
+    return offsets
+
+
+def _tablebase_index(red: int, black: int, kings: int, black_to_move: int, offsets: dict) -> int:
+    """
+    Return the index of a board and player to move in a tablebase with these offsets.
+    The squares of red are ranked among the 32 squares, the squares of black among the
+    squares red leaves free, then come one bit per piece (King or not, in square order)
+    and one bit for the player to move.
+    """
+    red_count = red.bit_count()
+    black_count = black.bit_count()
+    red_rank = 0
+    for i, sq in enumerate(squares(red)):
+        red_rank += BINOMIAL[sq][i + 1]
+    black_rank = 0
+    for i, sq in enumerate(squares(black)):
+        black_rank += BINOMIAL[sq - (red & ((1 << sq) - 1)).bit_count()][i + 1]
+    king_bits = 0
+    for i, sq in enumerate(squares(red | black)):
+        if kings >> sq & 1:
+            king_bits |= 1 << i
+    rank = red_rank * BINOMIAL[32 - red_count][black_count] + black_rank
+    rank = (rank << red_count + black_count) | king_bits
+    return offsets[(red_count, black_count)] + (rank << 1 | black_to_move)
+
+
+class Tablebase:
+    """
+    An endgame tablebase, read from a file written by build_tablebase. The file is mapped in
+    memory and a board is found by computing its index, so nothing is read when it is opened.
+    A Tablebase can be passed to worker processes: they open the file again.
+
+    Attributes:
+    pieces: Largest number of pieces of the boards in the file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file, self.data = _map_file(path, TABLEBASE_MAGIC, 4, 2, f"{path}: not a tablebase")
+        header = len(TABLEBASE_MAGIC) + 4
+        self.pieces = struct.unpack_from('<I', self.data, len(TABLEBASE_MAGIC))[0]
+        if self.pieces > 32:
+            self.close()
+            raise ValueError(f"{path}: not a tablebase")
+        self.offsets = _tablebase_offsets(self.pieces)
+        if len(self.data) != header + 2 * self.offsets['size']:
+            self.close()
+            raise ValueError(f"{path}: tablebase of the wrong size")
+
+    def __reduce__(self):
+        return Tablebase, (self.path,)
+
+    def __enter__(self) -> 'Tablebase':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Unmap and close the file."""
+        self.data.close()
+        self.file.close()
+
+    def code(self, state: State, player: str) -> int:
+        """
+        Return the code of state with player to move (see TABLEBASE_MAGIC).
+        Assume both players have pieces and there are at most self.pieces of them.
+        """
+        index = _tablebase_index(state.red, state.black, state.kings, player == 'b', self.offsets)
+        return struct.unpack_from('<H', self.data, len(TABLEBASE_MAGIC) + 4 + 2 * index)[0]
+
+    def value(self, state: State, player: str) -> Optional[int]:
+        """
+        Return the value of state with player to move for red: TABLEBASE_WIN - d if red wins
+        in d plies, d - TABLEBASE_WIN if red loses in d plies and 0 for a draw. Return None
+        if the board is not in the tablebase. A board where a player has no pieces left is
+        won in 0 plies by the other one.
+        """
+        if not state.red or not state.black:
+            return self.end_value(state, player)
+        if (state.red | state.black).bit_count() > self.pieces:
+            return None
+        code = self.code(state, player)
+        if code == TABLEBASE_INVALID:
+            return None
+        if code == 0:
+            return 0
+        value = TABLEBASE_WIN - (code - 1) // 2
+        # Odd codes are wins of the player to move.
+        return value if (code % 2 == 1) == (player == 'r') else -value
+
+    @staticmethod
+    def end_value(state: State, player: str) -> int:
+        """
+        Return the value for red of state, where the game is over (see terminal()), with
+        player to move: TABLEBASE_WIN if red won and -TABLEBASE_WIN if it lost, whatever the
+        number of pieces. The search scores the end of the game this way when it uses a
+        tablebase, so that winning now is never worth less than winning later in the table.
+        """
+        if not state.red or not state.black:
+            return TABLEBASE_WIN if state.red else -TABLEBASE_WIN
+        # The player to move loses if it cannot move, else the other player cannot.
+        won = has_any_move(state, player)
+        return TABLEBASE_WIN if won == (player == 'r') else -TABLEBASE_WIN
+
+
+def build_tablebase(pieces: int, path: str) -> int:
+    """
+    Solve every board of at most pieces pieces (both players having pieces), for both
+    players to move, by retrograde analysis, and write the results to path.
+    The game ends as in terminal(): a player without pieces or moves loses (the player to
+    move, if neither can move). Each board is then a win, a loss or a draw for the player to
+    move, with the number of plies to the end when both players play best (the winner as
+    fast and the loser as slow as possible). Return the number of boards solved.
+    Memory and time grow quickly with pieces: 3 pieces take seconds, 4 pieces a few
+    minutes and about 1 GB (a 32 MB file).
+    """
+    offsets = _tablebase_offsets(pieces)
+    size = offsets['size']
+    codes = array('H', [TABLEBASE_INVALID]) * size
+    # Moves left to resolve for each board, then the edges (successor, board) of the game graph.
+    remaining = array('B', [0]) * size
+    edge_from = array('I')
+    edge_to = array('I')
+    queue = deque()
+    later = []
+    boards = 0
+    for count in range(2, pieces + 1):
+        for red_count in range(1, count):
+            for red_squares in _combinations(FULL_BOARD, red_count):
+                for black_squares in _combinations(FULL_BOARD & ~red_squares, count - red_count):
+                    occupied = red_squares | black_squares
+                    for kings in _subsets(occupied):
+                        # A man is never on the row where it would have been promoted.
+                        if red_squares & ~kings & KING_ROWS['r'] or black_squares & ~kings & KING_ROWS['b']:
+                            continue
+                        state = State(red_squares, black_squares, kings)
+                        for side, player, other in ((0, 'r', 'b'), (1, 'b', 'r')):
+                            index = _tablebase_index(red_squares, black_squares, kings, side, offsets)
+                            boards += 1
+                            if terminal(state):
+                                codes[index] = 2 if not has_any_move(state, player) else 1
+                                queue.append(index)
+                                continue
+                            codes[index] = 0
+                            moves = generate_moves(state, player)
+                            won = False
+                            for move in moves:
+                                red, black = state.red ^ move.red, state.black ^ move.black
+                                if not red or not black:
+                                    won = True
+                                    break
+                                edge_from.append(_tablebase_index(red, black, state.kings ^ move.kings,
+                                                                  1 - side, offsets))
+                                edge_to.append(index)
+                            if won:
+                                # Capturing the last piece wins in 1 ply.
+                                codes[index] = 3
+                                later.append(index)
+                            remaining[index] = len(moves)
+    queue.extend(later)
+    # The boards that lead to each board, as ranges of predecessors sorted by successor.
+    starts = array('I', [0]) * (size + 1)
+    for successor in edge_from:
+        starts[successor + 1] += 1
+    for i in range(size):
+        starts[i + 1] += starts[i]
+    predecessors = array('I', [0]) * len(edge_from)
+    filled = array('I', starts[:size])
+    for successor, board in zip(edge_from, edge_to):
+        predecessors[filled[successor]] = board
+        filled[successor] += 1
+    del edge_from, edge_to, filled
+    # Boards are resolved by increasing distance: a board is won as soon as one move leads
+    # to a loss of the opponent, and lost when all its moves lead to wins of the opponent.
+    while queue:
+        index = queue.popleft()
+        code = codes[index]
+        distance = (code - 1) // 2
+        for board in predecessors[starts[index]:starts[index + 1]]:
+            if codes[board] != 0:
+                continue
+            if code % 2 == 0:
+                codes[board] = 1 + 2 * (distance + 1)
+                queue.append(board)
+            else:
+                remaining[board] -= 1
+                if remaining[board] == 0:
+                    codes[board] = 2 + 2 * (distance + 1)
+                    queue.append(board)
+    with open(path, 'wb') as f:
+        f.write(TABLEBASE_MAGIC)
+        f.write(struct.pack('<I', pieces))
+        if sys.byteorder != 'little':
+            codes.byteswap()
+        codes.tofile(f)
+    return boards
+
+
+def _combinations(mask: int, count: int) -> Iterator[int]:
+    """Helper function for build_tablebase that yields every subset of count squares of mask."""
+    if count == 0:
+        yield 0
+        return
+    for sq in squares(mask):
+        bit = 1 << sq
+        # The other squares are above sq, so each subset is made once.
+        for rest in _combinations(mask & ~((bit << 1) - 1), count - 1):
+            yield bit | rest
+
+
+def _subsets(mask: int) -> Iterator[int]:
+    """Helper function for build_tablebase that yields every subset of mask."""
+    subset = 0
+    while True:
+        yield subset
+        subset = (subset - mask) & mask
+        if subset == 0:
+            return
+
+
+def iterative_deepening(state: State, d_limit: int, time_limit: Optional[float],
+                        context: Optional[SearchContext] = None,
+                        on_depth: Optional[Callable[..., None]] = None) -> Optional[Move]:
+    """
+    Search state to depth 1, 2, 3, ... up to d_limit until time_limit seconds have passed
+    (None for no limit; the search can still be stopped with context.stop), and return the
+    best move of the deepest completed depth. The unfinished depth is thrown away, but
+    depth 1 is always completed so a move is returned. Each depth searches the principal
+    variation of the previous one first; when several moves have the same value, the move
+    returned can therefore differ from ab_search(state, depth) without time_limit.
+    on_depth, if given, is called with the depth, best move and value of each completed depth.
+    """
+    if context is None:
+        context = SearchContext()
+    if context.table is None:
+        context.table = TranspositionTable()
+    deadline = math.inf if time_limit is None else time.perf_counter() + time_limit
+    best_move = None
+    value = None
+    context.new_search(1)
+    for depth in range(1, d_limit + 1):
+        context.table.new_search()
+        # The killer moves and history scores of a depth are kept for the next one.
+        context.root = depth
+        # Depth 1 is searched without a deadline so that there is always a move.
+        context.deadline = deadline if depth > 1 else None
+        try:
+            # An unfinished depth leaves its board half way down the tree, so each
+            # depth searches its own copy.
+            if context.engine == 'pvs' and value is not None:
+                move, value = _aspiration_search(state, depth, value, context)
+            else:
+                move, value = max_value(clone(state), -math.inf, math.inf, depth, context)
+            best_move = move
+        except SearchTimeout:
+            break
+        finally:
+            context.deadline = None
+        context.depth = depth
+        context.pv = context.table.principal_variation(state, depth)
+        if on_depth is not None:
+            on_depth(depth, best_move, value)
+        if time.perf_counter() >= deadline:
+            break
     return best_move
 
 
-def max_value(state: State, a: float, b: float, d_limit: int):
-    """Minimax function for finding max node"""
+# Half width of the aspiration window around the value of the previous depth.
+ASPIRATION_WINDOW = 2
+
+
+def _aspiration_search(state: State, depth: int, guess: float,
+                       context: SearchContext) -> tuple[Optional[Move], float]:
+    """
+    Helper function for iterative_deepening: search state with a window of ASPIRATION_WINDOW
+    around guess, and again with the full window if the value falls outside of it.
+    A value inside the window is exact, and so is the move: moves outside the window
+    are worse than it.
+    """
+    a, b = guess - ASPIRATION_WINDOW, guess + ASPIRATION_WINDOW
+    move, value = max_value(clone(state), a, b, depth, context)
+    if value < a or value > b:
+        move, value = max_value(clone(state), -math.inf, math.inf, depth, context)
+    return move, value
+
+
+def max_value(state: State, a: float, b: float, d_limit: int,
+              context: Optional[SearchContext] = None):
+    """
+    Minimax function for finding max node.
+    Return the best Move and the value. The moves are made and taken back on state.
+    """
+    best_move = None
+    table = None
+    node = None
+    if context is not None:
+        table = context.table
+        if table is not None:
+            entry = table.probe(state.zobrist)
+            # At the root, an entry of an earlier search (of another board, or the same board
+            # searched before) can pick or put first another move of the same value; below
+            # the root, its value is as good as a new one.
+            if entry is not None and entry.age != table.age and d_limit == context.root:
+                entry = None
+            if entry is not None and entry.depth == d_limit and _cutoff(entry, a, b):
+                context.table_cutoffs += 1
+                if context.stats is not None:
+                    context.stats.at(d_limit).table_cutoffs += 1
+                return entry.best, entry.score
+        context.nodes += 1
+        if context.stats is not None:
+            node = context.stats.at(d_limit)
+            node.nodes += 1
+        if context.deadline is not None and (context.stop or time.perf_counter() > context.deadline):
+            raise SearchTimeout
+        if context.tablebase is not None and d_limit < context.root:
+            value = context.tablebase.value(state, 'r')
+            if value is not None:
+                context.tablebase_hits += 1
+                return None, value
+    over = terminal(state) if node is None else node.timed('terminal', terminal, state)
+    bound = EXACT
+    if over:
+        value = _end_value(state, 'r', context)
+    elif d_limit == 0 and context is not None and context.quiescence:
+        value = quiesce_max(state, a, b, context)
+        bound = _bound(value, a, b)
+    elif d_limit == 0:
+        evaluator = evaluate if context is None else context.evaluator
+        value = evaluator(state) if node is None else node.timed('evaluate', evaluator, state)
+    else:
+        a_orig = a
+        value = -math.inf
+        # Rearrange the list of moves by
+        # the heuristic value after the move by descending
+        # (index 0 is largest ont and the last index is the smallest one),
+        # or take them from staged_moves with a context
+        if context is None:
+            moves = rearrange_moves(state, generate_moves(state, 'r'), True)
+        else:
+            # The move of the principal variation first, then the best move in the table
+            first = (context.pv.get(state.zobrist) if context.pv else None,
+                     entry.best if table is not None and entry is not None else None)
+            moves = staged_moves(state, 'r', d_limit, context, first, node)
+            if node is not None:
+                node.expanded += 1
+        pvs = context is not None and context.engine == 'pvs'
+        for i, move in enumerate(moves):
+            state.apply(move)
+            if pvs and i > 0:
+                # Null window: the exact value is only needed if the move is better than a.
+                _, nxt_v = min_value(state, a, a, d_limit - 1, context)
+                if a < nxt_v <= b:
+                    _, nxt_v = min_value(state, a, b, d_limit - 1, context)
+            else:
+                _, nxt_v = min_value(state, a, b, d_limit - 1, context)
+            state.undo(move)
+            if value < nxt_v:
+                value = nxt_v
+                best_move = move
+            # alpha-beta pruning
+            if value > b:
+                if node is not None:
+                    node.cutoff(i)
+                if context is not None and not move.captured:
+                    _record_cutoff(context, move, d_limit)
+                break
+            a = max(a, value)
+        if table is not None:
+            table.store(state.zobrist, d_limit, value, _bound(value, a_orig, b), best_move)
+        return best_move, value
+    if table is not None:
+        table.store(state.zobrist, d_limit, value, bound, None)
+    return best_move, value
+
+
+def min_value(state: State, a: float, b: float, d_limit: int,
+              context: Optional[SearchContext] = None):
+    """
+    Minimax function for finding min.
+    Return the best Move and the value. The moves are made and taken back on state.
+    """
     best_move = None
-    if terminal(state):
-        return best_move, utility(state)
+    table = None
+    node = None
+    if context is not None:
+        table = context.table
+        key = state.zobrist ^ ZOBRIST_BLACK_TO_MOVE
+        if table is not None:
+            entry = table.probe(key)
+            if entry is not None and entry.depth == d_limit and _cutoff(entry, a, b):
+                context.table_cutoffs += 1
+                if context.stats is not None:
+                    context.stats.at(d_limit).table_cutoffs += 1
+                return entry.best, entry.score
+        context.nodes += 1
+        if context.stats is not None:
+            node = context.stats.at(d_limit)
+            node.nodes += 1
+        if context.deadline is not None and (context.stop or time.perf_counter() > context.deadline):
+            raise SearchTimeout
+        if context.tablebase is not None and d_limit < context.root:
+            value = context.tablebase.value(state, 'b')
+            if value is not None:
+                context.tablebase_hits += 1
+                return None, value
+    over = terminal(state) if node is None else node.timed('terminal', terminal, state)
+    bound = EXACT
+    if over:
+        value = _end_value(state, 'b', context)
+    elif d_limit == 0 and context is not None and context.quiescence:
+        value = quiesce_min(state, a, b, context)
+        bound = _bound(value, a, b)
     elif d_limit == 0:
-        return best_move, heuristic(state)
-    value = -math.inf
-    # Rearrange the list of expanded state by
-    # the heuristic value by descending
-    # (index 0 is largest ont and the last index is the smallest one)
-    ex_lst = expand(state, 'r')
-    ex_lst = rearrange(ex_lst, True)
-    for successor in ex_lst:
-        _, nxt_v = min_value(successor, a, b, d_limit - 1)
+        value = utility(state)
+    else:
+        b_orig = b
+        value = math.inf
+        # Rearrange the list of moves by
+        # the heuristic value after the move by ascending
+        # (index 0 is smallest ont and the last index is the largest one),
+        # or take them from staged_moves with a context
+        if context is None:
+            moves = rearrange_moves(state, generate_moves(state, 'b'), False)
+        else:
+            # The move of the principal variation first, then the best move in the table
+            first = (context.pv.get(key) if context.pv else None,
+                     entry.best if table is not None and entry is not None else None)
+            moves = staged_moves(state, 'b', d_limit, context, first, node)
+            if node is not None:
+                node.expanded += 1
+        pvs = context is not None and context.engine == 'pvs'
+        for i, move in enumerate(moves):
+            state.apply(move)
+            if pvs and i > 0:
+                # Null window: the exact value is only needed if the move is better than b.
+                _, nxt_v = max_value(state, b, b, d_limit - 1, context)
+                if a <= nxt_v < b:
+                    _, nxt_v = max_value(state, a, b, d_limit - 1, context)
+            else:
+                _, nxt_v = max_value(state, a, b, d_limit - 1, context)
+            state.undo(move)
+            if value > nxt_v:
+                value = nxt_v
+                best_move = move
+            # alpha-beta pruning
+            if value < a:
+                if node is not None:
+                    node.cutoff(i)
+                if context is not None and not move.captured:
+                    _record_cutoff(context, move, d_limit)
+                break
+            b = min(b, value)
+        if table is not None:
+            table.store(key, d_limit, value, _bound(value, a, b_orig), best_move)
+        return best_move, value
+    if table is not None:
+        table.store(key, d_limit, value, bound, None)
+    return best_move, value
+
+
+def quiesce_max(state: State, a: float, b: float, context: SearchContext) -> float:
+    """
+    Quiescence search of a leaf where red is to move: search the captures of red (and the
+    answers of black with quiesce_min) until no capture is left, so that the value is not
+    taken in the middle of an exchange. Red may also stop capturing, so the value is at
+    least context.evaluator(state) as at a leaf without quiescence. Assume the game is not over on state.
+    Return the value; the moves are made and taken back on state. The boards after the
+    captures are counted in context.nodes.
+    """
+    if context.deadline is not None and (context.stop or time.perf_counter() > context.deadline):
+        raise SearchTimeout
+    value = context.evaluator(state)
+    if value > b:
+        return value
+    a = max(a, value)
+    # Captures that take the most pieces first
+    for move in sorted(generate_captures(state, 'r'), key=lambda m: len(m.captured), reverse=True):
+        state.apply(move)
+        context.nodes += 1
+        nxt_v = _end_value(state, 'b', context) if terminal(state) else quiesce_min(state, a, b, context)
+        state.undo(move)
         if value < nxt_v:
             value = nxt_v
-            best_move = successor
         # alpha-beta pruning
         if value > b:
-            return best_move, value
+            break
         a = max(a, value)
-    return best_move, value
+    return value
 
 
-def min_value(state: State, a: float, b: float, d_limit: int):
-    """Minimax function for finding min """
-    best_move = None
-    if terminal(state) or d_limit == 0:
-        return best_move, utility(state)
-    value = math.inf
-    # Rearrange the list of expanded state by
-    # the heuristic value by ascending
-    # (index 0 is smallest ont and the last index is the largest one)
-    ex_lst = expand(state, 'b')
-    ex_lst = rearrange(ex_lst, False)
-    for successor in ex_lst:
-        _, nxt_v = max_value(successor, a, b, d_limit - 1)
+def quiesce_min(state: State, a: float, b: float, context: SearchContext) -> float:
+    """
+    Same as quiesce_max for a leaf where black is to move, starting from utility(state)
+    as at a leaf without quiescence.
+    """
+    if context.deadline is not None and (context.stop or time.perf_counter() > context.deadline):
+        raise SearchTimeout
+    value = utility(state)
+    if value < a:
+        return value
+    b = min(b, value)
+    # Captures that take the most pieces first
+    for move in sorted(generate_captures(state, 'b'), key=lambda m: len(m.captured), reverse=True):
+        state.apply(move)
+        context.nodes += 1
+        nxt_v = _end_value(state, 'r', context) if terminal(state) else quiesce_max(state, a, b, context)
+        state.undo(move)
         if value > nxt_v:
             value = nxt_v
-            best_move = successor
         # alpha-beta pruning
         if value < a:
-            return best_move, value
+            break
         b = min(b, value)
-    return best_move, value
+    return value
+
+
+def _end_value(state: State, player: str, context: Optional[SearchContext]) -> int:
+    """
+    Helper function for max_value, min_value and the quiescence search: the value of state
+    with player to move, where the game is over. It is utility(state), or Tablebase.end_value
+    with a tablebase, whose values are on another scale.
+    """
+    if context is None or context.tablebase is None:
+        return utility(state)
+    return context.tablebase.end_value(state, player)
+
+
+def _bound(value: float, a: float, b: float) -> int:
+    """
+    Return the bound type of a value searched with window (a, b). Pruning only
+    happens when a value is strictly outside the window, so values equal to a or b are exact.
+    """
+    if value > b:
+        return LOWER
+    if value < a:
+        return UPPER
+    return EXACT
+
+
+def _cutoff(entry: TableEntry, a: float, b: float) -> bool:
+    """Return True if entry decides the value of a node searched with window (a, b)."""
+    return entry.bound == EXACT or (entry.bound == LOWER and entry.score > b) \
+        or (entry.bound == UPPER and entry.score < a)
 
 
 def rearrange(ex_lst: list[State], reverse: bool) -> list[State]:
     """
     Helper function for rearranging state by the heuristic value
-    by descending index 0 is largest ont and
+    (computed by evaluate()) by descending index 0 is largest ont and
     the last index is the smallest one.
     param:
      - ex_lst: A list of expanded state.
      - reverse: False means return a list ordered by ascending;
                 True means return a list ordered by descending.
     """
-    return sorted(ex_lst, key=heuristic, reverse=reverse)
+    return sorted(ex_lst, key=evaluate, reverse=reverse)
+
+
+def rearrange_moves(state: State, moves: list[Move], reverse: bool) -> list[Move]:
+    """
+    Same as rearrange, for moves made on state: order them by the heuristic value
+    of the board after each move. Ties keep the order of moves.
+    """
+    scores = []
+    for move in moves:
+        state.apply(move)
+        scores.append(evaluate(state))
+        state.undo(move)
+    order = sorted(range(len(moves)), key=scores.__getitem__, reverse=reverse)
+    return [moves[i] for i in order]
+
+
+def staged_moves(state: State, player: str, d_limit: int, context: SearchContext,
+                 first: tuple, node: Optional[DepthStats] = None) -> Iterator[Move]:
+    """
+    Yield the moves of player at a node with d_limit depth left, best first, and generate
+    them only when they are needed: a node pruned by its first moves does not generate the others.
+    The moves of first (the moves of the principal variation and of the transposition table,
+    None if there is none) come before all the others. Within context.sort_plies plies of the
+    root, the other moves are sorted by heuristic value (rearrange_moves). Deeper, no board is
+    evaluated: the captures are generated first (most pieces taken first), then the other moves,
+    the killer moves of the ply first and the rest by history score.
+    node collects the number of moves generated and the time spent, if given.
+    Ties keep the order of generate_moves().
+    """
+    ply = context.root - d_limit
+    if context.sort_plies is None or ply < context.sort_plies:
+        moves = generate_moves(state, player) if node is None \
+            else node.timed('generate', generate_moves, state, player)
+        if node is not None:
+            node.moves += len(moves)
+        first = [move for move in first if move is not None and move in moves]
+        moves = rearrange_moves(state, moves, player == 'r') if node is None \
+            else node.timed('order', rearrange_moves, state, moves, player == 'r')
+        yield from dict.fromkeys(first + moves)
+        return
+    # A move of first comes from a board with the same Zobrist key, so it is a move of state.
+    tried = []
+    for move in first:
+        if move is not None and move not in tried:
+            tried.append(move)
+            yield move
+    moves = generate_captures(state, player) if node is None \
+        else node.timed('generate', generate_captures, state, player)
+    if node is not None:
+        node.moves += len(moves)
+    moves.sort(key=lambda m: len(m.captured), reverse=True)
+    for move in moves:
+        if move not in tried:
+            yield move
+    moves = generate_steps(state, player) if node is None \
+        else node.timed('generate', generate_steps, state, player)
+    if node is not None:
+        node.moves += len(moves)
+    for move in context.killers.get(ply, ()):
+        if move in moves and move not in tried:
+            tried.append(move)
+            yield move
+    history = context.history
+    moves.sort(key=lambda m: history.get(m.zobrist, 0), reverse=True)
+    for move in moves:
+        if move not in tried:
+            yield move
+
+
+def _record_cutoff(context: SearchContext, move: Move, d_limit: int) -> None:
+    """
+    Helper function for max_value and min_value that records a cutoff made by move
+    (without capture) at a node with d_limit depth left: it becomes the first killer move
+    of its ply and its history score grows by d_limit ** 2.
+    The Zobrist change of a move without capture identifies its piece, origin and destination.
+    """
+    killers = context.killers.setdefault(context.root - d_limit, [])
+    if move not in killers:
+        killers.insert(0, move)
+        del killers[2:]
+    context.history[move.zobrist] = context.history.get(move.zobrist, 0) + d_limit * d_limit
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        sys.exit("Error: Please provide exactly four arguments")
-    else:
-        s = txt_to_state(sys.argv[1])
-        res_state = ab_search(s, 7)
-
-        # Write the solution to target file
-        res_file = open(sys.argv[2], 'w')
-        # Write solution to res_file
-        res_file.write(res_state.__str__())
-        # Close files
-        res_file.close()
+    parser = argparse.ArgumentParser(description="Find the best move for red on a checkers board.")
+    parser.add_argument('input', help="board file (8 lines of 8 characters); with --batch, a file "
+                                      "of boards, a directory of board files, or - for stdin")
+    parser.add_argument('output', help="file the board after the best move is written to "
+                                       "(with --batch, - for stdout)")
+    parser.add_argument('--time', type=float, default=None,
+                        help="time budget in seconds (per board); search with iterative deepening")
+    parser.add_argument('--depth', type=int, default=None,
+                        help="search depth (default 7), or the deepest depth tried with --time")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes searching the moves at the root (not with --time); "
+                             "with --batch, number of processes searching boards")
+    parser.add_argument('--batch', action='store_true',
+                        help="solve every board of input and write the results in the same order")
+    parser.add_argument('--engine', choices=['alphabeta', 'pvs'], default='alphabeta',
+                        help="alpha-beta, or principal variation search with aspiration windows "
+                             "(same move, fewer nodes)")
+    parser.add_argument('--quiescence', action='store_true',
+                        help="search the captures left at the depth limit before evaluating")
+    parser.add_argument('--stats', default=None,
+                        help="write node counts, cutoff rates and timings of the search as JSON "
+                             "to this file (not with --workers)")
+    parser.add_argument('--tablebase', default=None,
+                        help="endgame tablebase file (see --build-tablebase) giving the value of the "
+                             "boards with few pieces during the search")
+    parser.add_argument('--build-tablebase', type=int, default=None, metavar='PIECES',
+                        help="solve every board of at most PIECES pieces and write the tablebase to "
+                             "output (input is ignored)")
+    parser.add_argument('--book', default=None,
+                        help="position book file (see --build-book) to look the boards up in "
+                             "before searching them; it must be built with the same --engine and "
+                             "--quiescence")
+    parser.add_argument('--build-book', action='store_true',
+                        help="search every board of input (a file of boards, a directory of board "
+                             "files, or - for stdin) to --depth (with --engine and --quiescence) and write them "
+                             "as a position book to output")
+    parser.add_argument('--pack-boards', action='store_true',
+                        help="write every board of input (as with --batch) to output as a board file "
+                             "(12 bytes a board), which --batch, --build-book and read_boards also read")
+    args = parser.parse_args()
+    if args.workers > 1 and args.time is not None and not args.batch:
+        parser.error("--workers cannot be used with --time")
+    if args.workers > 1 and args.stats is not None:
+        parser.error("--workers cannot be used with --stats")
+    stats = SearchStats() if args.stats is not None else None
+    depth = args.depth or (7 if args.time is None else 64)
+
+    if args.build_tablebase is not None:
+        count = build_tablebase(args.build_tablebase, args.output)
+        print(f"{count} boards solved and written to {args.output}", file=sys.stderr)
+        sys.exit()
+
+    if args.pack_boards:
+        count = write_board_file(read_boards(args.input), args.output)
+        print(f"{count} boards written to {args.output}", file=sys.stderr)
+        sys.exit()
+
+    tablebase = Tablebase(args.tablebase) if args.tablebase is not None else None
+    if args.build_book:
+        count = build_book(read_boards(args.input), depth, args.output, args.workers, args.quiescence,
+                           args.engine)
+        print(f"{count} boards written to {args.output}", file=sys.stderr)
+        sys.exit()
+
+    book = PositionBook(args.book) if args.book is not None else None
+    if book is not None:
+        try:
+            book.check(args.quiescence, args.engine)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.batch:
+        res_file = sys.stdout if args.output == '-' else open(args.output, 'w')
+        for i, (s, res_state) in enumerate(solve_boards(read_boards(args.input), depth, args.time,
+                                                        args.workers, stats, args.quiescence, book,
+                                                        tablebase, args.engine)):
+            if res_state is None:
+                # Keep the output aligned with the input: the board is written unchanged.
+                print(f"board {i}: game is over, no move", file=sys.stderr)
+                res_state = s
+            res_file.write(res_state.__str__())
+            res_file.flush()
+        if res_file is not sys.stdout:
+            res_file.close()
+        if stats is not None:
+            with open(args.stats, 'w') as stats_file:
+                stats.dump(stats_file)
+        sys.exit()
+
+    s = txt_to_state(args.input)
+    # With --time, the board is taken from the book whatever depth it was searched to.
+    res_state = book.best_board(s, depth if args.time is None else 0, args.quiescence, args.engine) \
+        if book is not None else None
+    if res_state is None and args.workers > 1:
+        context = SearchContext(TranspositionTable(), quiescence=args.quiescence, tablebase=tablebase,
+                                engine=args.engine)
+        _, res_state = parallel_search_move(s, depth, args.workers, context)
+    elif res_state is None:
+        context = SearchContext(TranspositionTable(), stats=stats, quiescence=args.quiescence,
+                                tablebase=tablebase, engine=args.engine)
+        res_state = ab_search(s, depth, context, args.time)
+
+    # Write the solution to target file
+    res_file = open(args.output, 'w')
+    # Write solution to res_file
+    res_file.write(res_state.__str__())
+    # Close files
+    res_file.close()
+    if stats is not None:
+        with open(args.stats, 'w') as stats_file:
+            stats.dump(stats_file)
@@ -0,0 +1,231 @@
+"""Play whole games of checkers between two searchers of checkers.py.
+
+Usage:
+    python selfplay.py [--games N] [--workers N] [--first SPEC] [--second SPEC] [--output FILE]
+
+A SPEC is a comma separated list of options of a searcher, for example
+'depth=5,engine=pvs,quiescence' or 'depth=9,time=0.5,evaluator=material'.
+The two searchers take turns playing red from one game to the next. Every game is
+written as a line of JSON (moves and result), and a summary goes to stderr.
+Each searcher keeps its transposition table, killer moves and history scores from
+one of its moves to the next during a game.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+import checkers
+
+START_BOARD = """\
+.b.b.b.b
+b.b.b.b.
+.b.b.b.b
+........
+........
+r.r.r.r.
+.r.r.r.r
+r.r.r.r.
+"""
+# Leaf values a searcher can use, by name.
+EVALUATORS = {'heuristic': checkers.evaluate, 'material': checkers.utility}
+
+
+@dataclass
+class SearcherConfig:
+    """
+    Options of a searcher.
+
+    Attributes:
+    depth: Search depth, or the deepest depth tried with time.
+    time: Time budget of a move in seconds (None to search to depth).
+    engine: SearchContext.engine ('alphabeta' or 'pvs').
+    evaluator: Name of the leaf values in EVALUATORS.
+    quiescence: SearchContext.quiescence.
+    tablebase: Path of a tablebase file (see checkers.build_tablebase), or None.
+    """
+    depth: int = 5
+    time: Optional[float] = None
+    engine: str = 'alphabeta'
+    evaluator: str = 'heuristic'
+    quiescence: bool = False
+    tablebase: Optional[str] = None
+
+
+def parse_config(spec: str) -> SearcherConfig:
+    """Return the SearcherConfig of a spec such as 'depth=5,engine=pvs,quiescence'."""
+    config = SearcherConfig()
+    for option in filter(None, spec.split(',')):
+        name, _, value = option.partition('=')
+        if name == 'depth':
+            config.depth = int(value)
+        elif name == 'time':
+            config.time = float(value)
+        elif name == 'engine' and value in ('alphabeta', 'pvs'):
+            config.engine = value
+        elif name == 'evaluator' and value in EVALUATORS:
+            config.evaluator = value
+        elif name == 'quiescence':
+            config.quiescence = value in ('', '1', 'true', 'yes')
+        elif name == 'tablebase':
+            config.tablebase = value
+        else:
+            raise ValueError(f"bad searcher option: {option}")
+    return config
+
+
+class Searcher:
+    """
+    A player of one game. It always searches for red, on the board turned to its side
+    (see checkers.flip), and keeps one SearchContext for the whole game.
+    """
+
+    def __init__(self, config: SearcherConfig) -> None:
+        self.config = config
+        tablebase = checkers.Tablebase(config.tablebase) if config.tablebase else None
+        self.context = checkers.SearchContext(checkers.TranspositionTable(), engine=config.engine,
+                                              quiescence=config.quiescence, tablebase=tablebase,
+                                              evaluator=EVALUATORS[config.evaluator], persistent=True)
+
+    def move(self, state: checkers.State) -> Optional[checkers.Move]:
+        """Return the best move of red on state (None if there is none)."""
+        context = self.context
+        # Two plies were played since the last search: the killer moves of a ply are
+        # now two plies closer to the root, and the history scores lose half their weight.
+        context.killers = {ply - 2: moves for ply, moves in context.killers.items() if ply >= 2}
+        context.history = {key: score // 2 for key, score in context.history.items() if score > 1}
+        move, _ = checkers.search_move(state, self.config.depth, context, self.config.time)
+        return move
+
+
+def play_game(red: SearcherConfig, black: SearcherConfig, seed: int = 0,
+              opening_plies: int = 2, max_plies: int = 200) -> dict:
+    """
+    Play a game from START_BOARD between red and black and return it as a dict with the
+    moves (see move_text), the result ('red', 'black' or 'draw'), the number of nodes searched
+    and the time taken. The first opening_plies moves are drawn at random (with seed) so
+    that games differ; the game is a draw after max_plies moves.
+    """
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    searchers = {'r': Searcher(red), 'b': Searcher(black)}
+    state = checkers.lines_to_state(START_BOARD.splitlines(), 'start')
+    player = 'r'
+    moves = []
+    result = 'draw'
+    for ply in range(max_plies):
+        if checkers.terminal(state):
+            result = winner(state, player)
+            break
+        view = state if player == 'r' else checkers.flip(state)
+        if ply < opening_plies:
+            move = rng.choice(checkers.generate_moves(view, 'r'))
+        else:
+            move = searchers[player].move(view)
+        view = checkers.clone(view)
+        view.apply(move)
+        state = view if player == 'r' else checkers.flip(view)
+        moves.append(move_text(move, player))
+        player = 'b' if player == 'r' else 'r'
+    else:
+        if checkers.terminal(state):
+            result = winner(state, player)
+    return {'seed': seed, 'result': result, 'plies': len(moves), 'moves': moves,
+            'nodes': {'red': searchers['r'].context.nodes, 'black': searchers['b'].context.nodes},
+            'seconds': time.perf_counter() - start}
+
+
+def winner(state: checkers.State, player: str) -> str:
+    """
+    Return the winner ('red' or 'black') of a game over on state with player to move:
+    the player without pieces or moves loses (the player to move, if neither can move).
+    """
+    other = 'b' if player == 'r' else 'r'
+    if checkers.has_any_move(state, player):
+        return 'red' if player == 'r' else 'black'
+    return 'red' if other == 'r' else 'black'
+
+
+def move_text(move: checkers.Move, player: str) -> str:
+    """
+    Return move as text, for example '2,5-3,4' for a step or '1,6x3,4x5,2' for a
+    double capture, in the coordinates of the input file. A move of black was found
+    on the turned board, so its positions are turned back.
+    """
+    positions = (move.origin,) + move.path
+    if player == 'b':
+        positions = tuple((7 - x, 7 - y) for x, y in positions)
+    separator = 'x' if move.captured else '-'
+    return separator.join(f"{x},{y}" for x, y in positions)
+
+
+def _play(args: tuple) -> dict:
+    """Helper function for play_games that plays a game in a worker process."""
+    index, first, second, opening_plies, max_plies = args
+    # The searchers take turns playing red, and each pair of games starts with the same moves.
+    red, black = (first, second) if index % 2 == 0 else (second, first)
+    game = play_game(red, black, index // 2, opening_plies, max_plies)
+    game['game'] = index
+    game['red'] = 'first' if index % 2 == 0 else 'second'
+    return game
+
+
+def play_games(first: SearcherConfig, second: SearcherConfig, games: int, workers: int = 1,
+               opening_plies: int = 2, max_plies: int = 200):
+    """
+    Play games between first and second (first playing red in the even games, the odd
+    games repeating the random opening of the game before) and yield them in order.
+    With workers > 1, games are played by a pool of worker processes.
+    """
+    tasks = [(i, first, second, opening_plies, max_plies) for i in range(games)]
+    if workers <= 1:
+        yield from map(_play, tasks)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(_play, tasks)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play checkers games between two searchers.")
+    parser.add_argument('--games', type=int, default=2, help="number of games (default 2)")
+    parser.add_argument('--workers', type=int, default=1, help="number of processes playing games")
+    parser.add_argument('--first', default='depth=5',
+                        help="options of the first searcher (default depth=5)")
+    parser.add_argument('--second', default='depth=5',
+                        help="options of the second searcher (default depth=5)")
+    parser.add_argument('--opening-plies', type=int, default=2,
+                        help="number of random moves starting each game (default 2)")
+    parser.add_argument('--max-plies', type=int, default=200,
+                        help="number of moves after which a game is a draw (default 200)")
+    parser.add_argument('--output', default='-',
+                        help="file the games are written to (default - for stdout)")
+    args = parser.parse_args()
+    try:
+        first, second = parse_config(args.first), parse_config(args.second)
+    except ValueError as e:
+        parser.error(str(e))
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    score = {'first': 0.0, 'second': 0.0}
+    start = time.perf_counter()
+    played = 0
+    for game in play_games(first, second, args.games, args.workers, args.opening_plies, args.max_plies):
+        out.write(json.dumps(game) + '\n')
+        out.flush()
+        played += 1
+        red = game['red']
+        black = 'second' if red == 'first' else 'first'
+        if game['result'] == 'draw':
+            score['first'] += 0.5
+            score['second'] += 0.5
+        else:
+            score[red if game['result'] == 'red' else black] += 1
+    if out is not sys.stdout:
+        out.close()
+    seconds = time.perf_counter() - start
+    print(f"{played} games in {seconds:.1f}s ({played * 3600 / seconds:.0f} games per hour): "
+          f"first {score['first']}, second {score['second']}", file=sys.stderr)
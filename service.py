@@ -0,0 +1,357 @@
+"""Search boards of checkers.py from asyncio, in a pool of worker processes.
+
+Usage:
+    python service.py [--socket PATH] [--workers N] [--engine pvs] [--quiescence] [--tablebase FILE]
+
+Requests and answers are lines of JSON, read from stdin and written to stdout, or
+exchanged with each client of a Unix socket with --socket. A request
+
+    {"id": 1, "board": ".b.b.b.b\\nb.b.b.b.\\n...", "depth": 9, "time": 2.0}
+
+searches the board (8 lines, red to move) with iterative deepening to "depth" (default 7)
+for at most "time" seconds (default no limit), and {"cancel": 1} stops it. The best move
+of every completed depth is sent as soon as it is found:
+
+    {"id": 1, "depth": 4, "move": [[2, 5], [3, 4]], "value": 3, "board": "...", "nodes": 812, "seconds": 0.01}
+
+and the search ends with {"id": 1, "done": true, "depth": 9} (with "cancelled" and "error"
+when it did not complete). The searches of a socket client are stopped when it disconnects.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, NamedTuple, Optional
+
+import checkers
+
+# Seconds between two looks of a worker at the cancel flag of its search.
+CANCEL_POLL = 0.02
+
+
+class DepthResult(NamedTuple):
+    """The best move of red found by a completed depth of a search."""
+    depth: int
+    move: checkers.Move
+    value: float
+    board: checkers.State
+    nodes: int
+    seconds: float
+
+
+class SearchService:
+    """
+    Search boards in a pool of worker processes for asyncio code. A search streams the
+    best move of each depth it completes (see search), and is stopped when its consumer
+    stops reading it. Each worker keeps its transposition table from one search to the next.
+    At most slots searches are running or waiting in the pool; more wait for a slot.
+    """
+
+    def __init__(self, workers: int = 1, slots: Optional[int] = None, quiescence: bool = False,
+                 tablebase: Optional[checkers.Tablebase] = None, engine: str = 'alphabeta') -> None:
+        slots = slots or 2 * workers
+        self.loop = asyncio.get_running_loop()
+        # Workers are started with spawn, not fork: a worker forked while another thread
+        # holds a lock (serve_stdin waiting in sys.stdin.readline) would wait for it forever.
+        mp_context = multiprocessing.get_context('spawn')
+        self.events = mp_context.Queue()
+        # cancelled[slot] is set to stop the search running in slot.
+        self.cancelled = mp_context.Array('b', slots, lock=False)
+        options = {'quiescence': quiescence, 'tablebase': tablebase, 'engine': engine}
+        self.pool = ProcessPoolExecutor(workers, mp_context=mp_context, initializer=_init_service_worker,
+                                        initargs=(self.events, self.cancelled, options))
+        self.free_slots = asyncio.Queue()
+        for slot in range(slots):
+            self.free_slots.put_nowait(slot)
+        self.streams = {}
+        self.ids = itertools.count()
+        self.reader = threading.Thread(target=self._read_events, daemon=True)
+        self.reader.start()
+
+    async def __aenter__(self) -> 'SearchService':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Stop the searches still running and shut the worker processes down."""
+        for slot in range(len(self.cancelled)):
+            self.cancelled[slot] = 1
+        await self.loop.run_in_executor(None, self.pool.shutdown)
+        self.events.put(None)
+        await self.loop.run_in_executor(None, self.reader.join)
+
+    async def search(self, state: checkers.State, d_limit: int = 7,
+                     time_limit: Optional[float] = None) -> AsyncIterator[DepthResult]:
+        """
+        Search state with iterative deepening to d_limit (for at most time_limit seconds)
+        and yield the DepthResult of every depth as it completes. Nothing is yielded if
+        the game is over. Closing the generator, or cancelling the task reading it, stops
+        the search in its worker.
+        """
+        slot = await self.free_slots.get()
+        search_id = next(self.ids)
+        stream = asyncio.Queue()
+        self.streams[search_id] = (stream, slot)
+        self.cancelled[slot] = 0
+        finished = False
+        try:
+            future = self.pool.submit(_service_search, search_id, slot,
+                                      (state.red, state.black, state.kings), d_limit, time_limit)
+            future.add_done_callback(lambda f: self._check_future(search_id, f))
+            while True:
+                kind, payload = await stream.get()
+                if kind == 'depth':
+                    yield payload
+                    continue
+                finished = True
+                if kind == 'error':
+                    raise payload
+                return
+        finally:
+            if not finished:
+                # The slot is given back when the worker reports the end of the search.
+                self.cancelled[slot] = 1
+
+    async def best_move(self, state: checkers.State, d_limit: int = 7,
+                        time_limit: Optional[float] = None) -> Optional[DepthResult]:
+        """Return the DepthResult of the deepest depth completed by search (None if the game is over)."""
+        result = None
+        async for result in self.search(state, d_limit, time_limit):
+            pass
+        return result
+
+    def _check_future(self, search_id: int, future) -> None:
+        """
+        Helper function for search that ends the search if its worker failed or never ran it
+        (it then sends no 'done' message). Called in a thread of the pool.
+        """
+        if future.cancelled():
+            self.loop.call_soon_threadsafe(self._dispatch, (search_id, 'done', True))
+        elif future.exception() is not None:
+            self.loop.call_soon_threadsafe(self._dispatch, (search_id, 'error', future.exception()))
+
+    def _read_events(self) -> None:
+        """Pass the messages of the workers to the event loop (in a thread of its own)."""
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            self.loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event: tuple) -> None:
+        """Helper function for search that hands a message of a worker to the search it is about."""
+        search_id, kind, payload = event
+        if search_id not in self.streams:
+            return
+        stream, slot = self.streams[search_id]
+        if kind == 'depth':
+            depth, move, value, board, nodes, seconds = payload
+            payload = DepthResult(depth, move, value, checkers.State(*board), nodes, seconds)
+        else:
+            del self.streams[search_id]
+            self.free_slots.put_nowait(slot)
+        stream.put_nowait((kind, payload))
+
+
+# Set in each worker process of SearchService (by _init_service_worker).
+_events = None
+_cancelled = None
+_service_context = None
+
+
+def _init_service_worker(events, cancelled, options: dict) -> None:
+    """
+    Initialize a worker process of SearchService with the queue its messages go to, the
+    cancel flags of the slots and a SearchContext made with options.
+    """
+    global _events, _cancelled, _service_context
+    _events = events
+    _cancelled = cancelled
+    _service_context = checkers.SearchContext(checkers.TranspositionTable(), **options)
+
+
+def _service_search(search_id: int, slot: int, board: tuple, d_limit: int,
+                    time_limit: Optional[float]) -> None:
+    """
+    Search the board given as (red, black, kings) in a worker of SearchService, sending a
+    'depth' message for each completed depth and a 'done' message (with True if the search
+    was cancelled) at the end.
+    """
+    context = _service_context
+    state = checkers.State(*board)
+    nodes = context.nodes
+    start = time.perf_counter()
+
+    def on_depth(depth, move, value):
+        if move is not None:
+            after = checkers.clone(state)
+            after.apply(move)
+            _events.put((search_id, 'depth', (depth, move, value, (after.red, after.black, after.kings),
+                                              context.nodes - nodes, time.perf_counter() - start)))
+
+    if not _cancelled[slot]:
+        context.stop = False
+        finished = threading.Event()
+        watcher = threading.Thread(target=_watch_cancel, args=(slot, finished, context))
+        watcher.start()
+        try:
+            checkers.iterative_deepening(state, d_limit, time_limit, context, on_depth)
+        finally:
+            finished.set()
+            watcher.join()
+    _events.put((search_id, 'done', bool(_cancelled[slot])))
+
+
+def _watch_cancel(slot: int, finished: threading.Event, context: checkers.SearchContext) -> None:
+    """Helper function for _service_search that stops the search when slot is cancelled."""
+    while not finished.wait(CANCEL_POLL):
+        if _cancelled[slot]:
+            context.stop = True
+            return
+
+
+def move_path(move: checkers.Move) -> list[list[int]]:
+    """Return the positions move goes through, starting with its origin, as [x, y] lists."""
+    return [list(position) for position in (move.origin,) + move.path]
+
+
+class Session:
+    """The searches asked for by one client of serve, answered with write(line)."""
+
+    def __init__(self, service: SearchService, write) -> None:
+        self.service = service
+        self.write = write
+        self.tasks = {}
+
+    def handle(self, line: str) -> None:
+        """Start or cancel the search asked for by a line of JSON."""
+        request_id = None
+        try:
+            request = json.loads(line)
+            if 'cancel' in request:
+                task = self.tasks.get(request['cancel'])
+                if task is not None:
+                    task.cancel()
+                return
+            request_id = request.get('id')
+            state = checkers.lines_to_state(request['board'].splitlines(), f"request {request_id}")
+            d_limit = int(request.get('depth', 7))
+            time_limit = request.get('time')
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            self.write({'id': request_id, 'error': f"bad request: {e}"})
+            return
+        if request_id in self.tasks:
+            self.write({'id': request_id, 'error': "a search with this id is running"})
+            return
+        self.tasks[request_id] = asyncio.create_task(self._search(request_id, state, d_limit, time_limit))
+
+    async def _search(self, request_id, state: checkers.State, d_limit: int,
+                      time_limit: Optional[float]) -> None:
+        """Helper function for handle that streams a search to the client."""
+        depth = 0
+        try:
+            async for result in self.service.search(state, d_limit, time_limit):
+                depth = result.depth
+                self.write({'id': request_id, 'depth': result.depth, 'move': move_path(result.move),
+                            'value': result.value, 'board': str(result.board), 'nodes': result.nodes,
+                            'seconds': round(result.seconds, 4)})
+            self.write({'id': request_id, 'done': True, 'depth': depth})
+        except asyncio.CancelledError:
+            self.write({'id': request_id, 'done': True, 'depth': depth, 'cancelled': True})
+        except Exception as e:
+            self.write({'id': request_id, 'done': True, 'depth': depth, 'error': repr(e)})
+        finally:
+            del self.tasks[request_id]
+
+    async def wait(self) -> None:
+        """Wait for the searches still running."""
+        while self.tasks:
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    async def cancel(self) -> None:
+        """Stop the searches still running."""
+        for task in list(self.tasks.values()):
+            task.cancel()
+        await self.wait()
+
+
+async def serve_stdin(service: SearchService) -> None:
+    """Answer the requests of stdin on stdout, and wait for the searches left at the end of stdin."""
+    loop = asyncio.get_running_loop()
+
+    def write(message):
+        sys.stdout.write(json.dumps(message) + '\n')
+        sys.stdout.flush()
+
+    session = Session(service, write)
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            break
+        if line.strip():
+            session.handle(line)
+    await session.wait()
+
+
+async def serve_socket(service: SearchService, path: str) -> None:
+    """Answer the requests of every client of the Unix socket at path until interrupted."""
+
+    async def client(reader, writer):
+        def write(message):
+            if not writer.is_closing():
+                writer.write((json.dumps(message) + '\n').encode())
+
+        session = Session(service, write)
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    session.handle(line.decode())
+        except ConnectionError:
+            pass
+        # The client is gone: its searches are not needed anymore.
+        await session.cancel()
+        writer.close()
+
+    server = await asyncio.start_unix_server(client, path)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        os.remove(path)
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Run the service with the command line options."""
+    tablebase = checkers.Tablebase(args.tablebase) if args.tablebase is not None else None
+    async with SearchService(args.workers, args.slots, args.quiescence, tablebase, args.engine) as service:
+        if args.socket is None:
+            await serve_stdin(service)
+        else:
+            await serve_socket(service, args.socket)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve checkers searches as lines of JSON.")
+    parser.add_argument('--socket', default=None,
+                        help="path of a Unix socket to serve on (default: stdin and stdout)")
+    parser.add_argument('--workers', type=int, default=1, help="number of processes searching boards")
+    parser.add_argument('--slots', type=int, default=None,
+                        help="number of searches running or waiting in the pool (default 2 * workers)")
+    parser.add_argument('--engine', choices=['alphabeta', 'pvs'], default='alphabeta',
+                        help="search engine (see checkers.SearchContext.engine)")
+    parser.add_argument('--quiescence', action='store_true',
+                        help="search the captures left at the depth limit before evaluating")
+    parser.add_argument('--tablebase', default=None, help="endgame tablebase file used by the searches")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,110 @@
+"""Boards shared by the tests."""
+import random
+
+import checkers
+
+
+def board(text: str) -> checkers.State:
+    """Return the board drawn in text, 8 lines of 8 characters as in a board file."""
+    red = black = kings = 0
+    for y, row in enumerate(text.splitlines()):
+        for x, char in enumerate(row):
+            if char in 'rRbB':
+                bit = checkers.square_mask((x, y))
+                if char in 'rR':
+                    red |= bit
+                else:
+                    black |= bit
+                if char.isupper():
+                    kings |= bit
+    return checkers.State(red, black, kings)
+
+
+def random_board(rng: random.Random) -> checkers.State:
+    """
+    Return a board of up to 24 pieces on random squares, some of them Kings. A man is never
+    put on the row where it would have been promoted.
+    """
+    red = black = kings = 0
+    for sq in rng.sample(range(32), rng.randint(0, 24)):
+        bit = 1 << sq
+        if rng.random() < 0.5:
+            red |= bit
+            promoted = bit & checkers.KING_ROWS['r']
+        else:
+            black |= bit
+            promoted = bit & checkers.KING_ROWS['b']
+        if promoted or rng.random() < 0.25:
+            kings |= bit
+    return checkers.State(red, black, kings)
+
+
+def random_boards(seed: int, count: int) -> list[checkers.State]:
+    """Return count boards of random_board, the same for the same seed."""
+    rng = random.Random(seed)
+    return [random_board(rng) for _ in range(count)]
+
+
+# Some boards of the opening, middle game and endgame, with single and multiple jumps.
+POSITIONS = {
+    'opening-start': board("""\
+.b.b.b.b
+b.b.b.b.
+.b.b.b.b
+........
+........
+r.r.r.r.
+.r.r.r.r
+r.r.r.r.
+"""),
+    'midgame-1': board("""\
+.b.....b
+b.....b.
+.b.b...b
+r.b.r.b.
+...r.r..
+..r...b.
+...r.r.r
+r.....r.
+"""),
+    'midgame-3': board("""\
+.b.b...b
+b.b.b.b.
+.b.....b
+....b.b.
+.r.....r
+r.r.b.r.
+.r.r...r
+r...r.r.
+"""),
+    'kings-1': board("""\
+........
+B...R...
+........
+B.......
+.r.....R
+........
+.....b..
+........
+"""),
+    'jumps-1': board("""\
+.b.b.b..
+....r.b.
+.b...b.b
+....r...
+.b......
+r.r.r...
+...r.r..
+r.r.....
+"""),
+    'jumps-3': board("""\
+...R.b.b
+..b...b.
+.....r..
+b.b...b.
+.r...r.b
+r.r.....
+.....B..
+r.B.....
+"""),
+}
@@ -0,0 +1,70 @@
+"""Board text and board files of checkers.py."""
+import pytest
+
+import checkers
+from boards import POSITIONS, board, random_boards
+
+
+def test_text_round_trip():
+    for state in random_boards(10, 1000):
+        text = str(state)
+        assert board(text) == state
+        assert checkers.lines_to_state(text.splitlines()) == state
+
+
+def test_row_tables_match_fallback():
+    # Rows with other characters than '.' are not in ROW_CODES and are read one
+    # character at a time.
+    for state in random_boards(11, 1000):
+        lines = str(state).splitlines()
+        assert checkers.lines_to_state([line.replace('.', ' ') for line in lines]) == state
+        # A single such row sends the whole board to the fallback.
+        assert checkers.lines_to_state(lines[:7] + [lines[7].replace('.', '-')]) == state
+
+
+def test_piece_on_white_space():
+    lines = str(POSITIONS['opening-start']).splitlines()
+    lines[3] = '.r......'
+    with pytest.raises(ValueError, match=r'white space \(1, 3\)'):
+        checkers.lines_to_state(lines, 'bad board')
+
+
+def test_board_file_round_trip(tmp_path):
+    path = str(tmp_path / 'boards.bin')
+    states = random_boards(12, 100)
+    assert checkers.write_board_file(states, path) == len(states)
+    with checkers.BoardFile(path) as boards:
+        assert len(boards) == len(states)
+        assert list(boards) == states
+        assert boards[0] == states[0]
+        assert boards[-1] == states[-1]
+        assert boards[-len(states)] == states[0]
+        with pytest.raises(IndexError):
+            boards[len(states)]
+        with pytest.raises(IndexError):
+            boards[-len(states) - 1]
+
+
+def test_read_boards_by_magic(tmp_path):
+    states = list(POSITIONS.values())
+    checkers.write_board_file(states, str(tmp_path / 'b.bin'))
+    # Text boards separated by blank lines, in a file whose name says nothing of its format.
+    (tmp_path / 'a.bin').write_text('\n'.join(str(state) for state in states))
+    assert list(checkers.read_boards(str(tmp_path / 'b.bin'))) == states
+    assert list(checkers.read_boards(str(tmp_path / 'a.bin'))) == states
+    assert list(checkers.read_boards(str(tmp_path))) == states + states
+
+
+def test_not_a_board_file(tmp_path):
+    path = tmp_path / 'boards.bin'
+    path.write_bytes(checkers.BOARDS_MAGIC + b'\0' * 5)
+    with pytest.raises(ValueError, match='not a board file'):
+        checkers.BoardFile(str(path))
+
+
+@pytest.mark.parametrize('content', [b'', b'CKBO', b'NOTBOARD' + b'\0' * 12])
+def test_short_or_foreign_board_file(tmp_path, content):
+    path = tmp_path / 'boards.bin'
+    path.write_bytes(content)
+    with pytest.raises(ValueError, match='not a board file'):
+        checkers.BoardFile(str(path))
@@ -0,0 +1,40 @@
+"""Position books of checkers.py."""
+import pytest
+
+import checkers
+from boards import POSITIONS
+
+
+def test_book_answers_as_search(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    states = list(POSITIONS.values())
+    assert checkers.build_book(states, 3, path) == len(states)
+    with checkers.PositionBook(path) as book:
+        assert (book.quiescence, book.engine) == (False, 'alphabeta')
+        for state in states:
+            expected = checkers.ab_search(state, 3, checkers.SearchContext(checkers.TranspositionTable()))
+            assert book.best_board(state, 3) == expected
+            assert book.best_board(state, 4) is None
+
+
+def test_book_refuses_other_search_options(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    checkers.build_book([POSITIONS['jumps-1']], 3, path, quiescence=True, engine='pvs')
+    with checkers.PositionBook(path) as book:
+        assert (book.quiescence, book.engine) == (True, 'pvs')
+        assert book.best_board(POSITIONS['jumps-1'], 3, quiescence=True, engine='pvs') is not None
+        with pytest.raises(ValueError):
+            book.best_board(POSITIONS['jumps-1'], 3)
+        with pytest.raises(ValueError):
+            book.best_board(POSITIONS['jumps-1'], 3, quiescence=True)
+        with pytest.raises(ValueError):
+            list(checkers.solve_boards([POSITIONS['jumps-1']], 3, book=book, engine='pvs'))
+
+
+@pytest.mark.parametrize('content', [b'', checkers.BOOK_MAGIC, checkers.BOOK_MAGIC + b'\0' * 20,
+                                     b'NOTABOOK' + b'\0' * 40])
+def test_short_or_foreign_book(tmp_path, content):
+    path = tmp_path / 'book.bin'
+    path.write_bytes(content)
+    with pytest.raises(ValueError, match='not a position book'):
+        checkers.PositionBook(str(path))
@@ -0,0 +1,40 @@
+"""evaluate() and evaluate_batch() against heuristic() on random boards."""
+import pytest
+
+import checkers
+from boards import POSITIONS, random_boards
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_evaluate_matches_heuristic(seed):
+    for state in random_boards(seed, 500):
+        assert checkers.evaluate(state) == checkers.heuristic(state), str(state)
+
+
+def test_evaluate_matches_heuristic_after_moves():
+    for name, state in POSITIONS.items():
+        for player in ('r', 'b'):
+            for board in checkers.generate_successors(state, player):
+                assert checkers.evaluate(board) == checkers.heuristic(board), name
+
+
+def test_evaluate_batch_without_numpy(monkeypatch):
+    monkeypatch.setattr(checkers, 'np', None)
+    states = random_boards(4, 500)
+    assert checkers.evaluate_batch(states) == [checkers.heuristic(state) for state in states]
+
+
+@pytest.mark.parametrize('seed', range(5, 9))
+def test_evaluate_batch_with_numpy(seed):
+    pytest.importorskip('numpy')
+    states = random_boards(seed, 1000)
+    assert checkers.evaluate_batch(states) == [checkers.heuristic(state) for state in states]
+
+
+def test_evaluate_batch_popcount_fallback(monkeypatch):
+    # NumPy before 2.0 has no bitwise_count; the bits are then counted by shifts and masks.
+    np = pytest.importorskip('numpy')
+    if hasattr(np, 'bitwise_count'):
+        monkeypatch.delattr(np, 'bitwise_count')
+    states = random_boards(9, 1000)
+    assert checkers.evaluate_batch(states) == [checkers.heuristic(state) for state in states]
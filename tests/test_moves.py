@@ -0,0 +1,84 @@
+"""Move generation of checkers.py against the boards of the original expand()."""
+import pytest
+
+import checkers
+from boards import POSITIONS, random_boards
+
+# Successors of the start position, in the order of the original expand().
+START_SUCCESSORS = [
+    ".b.b.b.b\nb.b.b.b.\n.b.b.b.b\n........\n.r......\n..r.r.r.\n.r.r.r.r\nr.r.r.r.\n",
+    ".b.b.b.b\nb.b.b.b.\n.b.b.b.b\n........\n.r......\nr...r.r.\n.r.r.r.r\nr.r.r.r.\n",
+    ".b.b.b.b\nb.b.b.b.\n.b.b.b.b\n........\n...r....\nr...r.r.\n.r.r.r.r\nr.r.r.r.\n",
+    ".b.b.b.b\nb.b.b.b.\n.b.b.b.b\n........\n...r....\nr.r...r.\n.r.r.r.r\nr.r.r.r.\n",
+    ".b.b.b.b\nb.b.b.b.\n.b.b.b.b\n........\n.....r..\nr.r...r.\n.r.r.r.r\nr.r.r.r.\n",
+    ".b.b.b.b\nb.b.b.b.\n.b.b.b.b\n........\n.....r..\nr.r.r...\n.r.r.r.r\nr.r.r.r.\n",
+    ".b.b.b.b\nb.b.b.b.\n.b.b.b.b\n........\n.......r\nr.r.r...\n.r.r.r.r\nr.r.r.r.\n",
+]
+
+# Number of successors of each board (red to move, black to move), as counted by the
+# original expand().
+SUCCESSOR_COUNTS = {
+    'opening-start': (7, 7), 'midgame-1': (8, 9), 'midgame-3': (10, 11),
+    'kings-1': (7, 6), 'jumps-1': (9, 10), 'jumps-3': (9, 14),
+}
+
+
+def test_start_successors():
+    successors = checkers.generate_successors(POSITIONS['opening-start'], 'r')
+    assert [str(s) for s in successors] == START_SUCCESSORS
+
+
+@pytest.mark.parametrize('name', sorted(POSITIONS))
+@pytest.mark.parametrize('player', ['r', 'b'])
+def test_successors_match_expand(name, player):
+    state = POSITIONS[name]
+    successors = checkers.generate_successors(state, player)
+    assert len(successors) == SUCCESSOR_COUNTS[name][player == 'b']
+    assert successors == checkers.expand(state, player)
+
+
+# perft of the start position (red first) to depth 1, 2, ..., counted with the original expand().
+START_PERFT = [7, 49, 379, 2872, 23582]
+
+# perft of some boards to depth 1, 2 and 3, red first then black first.
+PERFT = {
+    'jumps-1': ([9, 77, 643], [10, 86, 723]),
+    'jumps-3': ([9, 118, 897], [14, 115, 1419]),
+    'kings-1': ([7, 42, 299], [6, 42, 263]),
+}
+
+
+@pytest.mark.parametrize('depth', range(1, len(START_PERFT) + 1))
+def test_start_perft(depth):
+    assert checkers.perft(POSITIONS['opening-start'], 'r', depth) == START_PERFT[depth - 1]
+
+
+@pytest.mark.parametrize('name', sorted(PERFT))
+@pytest.mark.parametrize('player', ['r', 'b'])
+def test_perft_modes(name, player):
+    state = POSITIONS[name]
+    expected = PERFT[name][player == 'b']
+    for depth, count in enumerate(expected, 1):
+        assert checkers.perft(state, player, depth) == count
+        assert checkers.perft(state, player, depth, reference=True) == count
+    fast = checkers.perft_divide(state, player, len(expected))
+    assert fast == checkers.perft_divide(state, player, len(expected), reference=True)
+    assert sum(fast.values()) == expected[-1]
+
+
+def old_terminal(state: checkers.State) -> bool:
+    """terminal() as it was defined with expand()."""
+    return state.red == 0 or state.black == 0 \
+        or len(checkers.expand(state, 'r')) == 0 or len(checkers.expand(state, 'b')) == 0
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_end_of_game_masks(seed):
+    for state in random_boards(seed, 1000):
+        assert checkers.terminal(state) == old_terminal(state), str(state)
+        for player, opponent in (('r', 'black'), ('b', 'red')):
+            successors = checkers.expand(state, player)
+            assert checkers.has_any_move(state, player) == bool(successors), str(state)
+            captures = [s for s in successors
+                        if getattr(s, opponent).bit_count() < getattr(state, opponent).bit_count()]
+            assert checkers.can_capture(state, player) == bool(captures), str(state)
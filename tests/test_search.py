@@ -0,0 +1,65 @@
+"""Searches of checkers.py that must give the same answer in every mode."""
+import math
+
+import pytest
+
+import checkers
+from boards import POSITIONS
+
+
+@pytest.mark.parametrize('name', sorted(POSITIONS))
+@pytest.mark.parametrize('d_limit', [3, 4])
+def test_table_keeps_the_move(name, d_limit):
+    state = POSITIONS[name]
+    expected = checkers.ab_search(state, d_limit)
+    assert checkers.ab_search(state, d_limit, checkers.SearchContext(checkers.TranspositionTable())) == expected
+
+
+@pytest.mark.parametrize('d_limit', [3, 4])
+@pytest.mark.parametrize('engine', ['alphabeta', 'pvs'])
+def test_parallel_matches_serial(d_limit, engine):
+    for name, state in POSITIONS.items():
+        expected = checkers.search_move(state, d_limit,
+                                        checkers.SearchContext(checkers.TranspositionTable(), engine=engine))
+        context = checkers.SearchContext(checkers.TranspositionTable(), engine=engine)
+        assert checkers.parallel_search_move(state, d_limit, 2, context)[1] == expected[1], name
+
+
+@pytest.mark.parametrize('d_limit', [3, 4, 5])
+@pytest.mark.parametrize('quiescence', [False, True])
+def test_pvs_matches_alphabeta(d_limit, quiescence):
+    for name, state in POSITIONS.items():
+        results = []
+        for engine in ('alphabeta', 'pvs'):
+            context = checkers.SearchContext(checkers.TranspositionTable(), quiescence=quiescence, engine=engine)
+            context.new_search(d_limit)
+            results.append(checkers.max_value(checkers.clone(state), -math.inf, math.inf, d_limit, context))
+        assert results[0] == results[1], name
+
+
+def test_pvs_matches_alphabeta_with_time_limit():
+    # The time limit is never reached, so every depth is completed. On kings-1, the value of
+    # depths 4 and 5 falls outside the aspiration window and is searched again.
+    for name, state in POSITIONS.items():
+        results = []
+        for engine in ('alphabeta', 'pvs'):
+            context = checkers.SearchContext(checkers.TranspositionTable(), engine=engine)
+            results.append(checkers.search_move(state, 5, context, time_limit=600))
+        assert results[0] == results[1], name
+
+
+def single_board(state: checkers.State, d_limit: int) -> checkers.State:
+    """The answer of the command line without --batch."""
+    return checkers.ab_search(state, d_limit, checkers.SearchContext(checkers.TranspositionTable()))
+
+
+def test_batch_matches_single_board():
+    # The boards two plies after the start share most of their trees, so the table of a
+    # batch holds entries for the root of the next boards.
+    start = POSITIONS['opening-start']
+    states = [start]
+    for successor in checkers.generate_successors(start, 'r'):
+        states += checkers.generate_successors(successor, 'b')
+    expected = [single_board(state, 4) for state in states]
+    assert [result for _, result in checkers.solve_boards(states, 4)] == expected
+    assert [result for _, result in checkers.solve_boards(states, 4, workers=2)] == expected
@@ -0,0 +1,45 @@
+"""Games of selfplay.py, replayed move by move."""
+import pytest
+
+import checkers
+import selfplay
+
+
+def replay(game: dict) -> tuple[checkers.State, str]:
+    """
+    Play the moves of game from the start board, each one found among the moves of
+    generate_moves, and return the board and the player to move at the end.
+    """
+    state = checkers.lines_to_state(selfplay.START_BOARD.splitlines(), 'start')
+    player = 'r'
+    for text in game['moves']:
+        separator = 'x' if 'x' in text else '-'
+        positions = tuple(tuple(int(c) for c in position.split(',')) for position in text.split(separator))
+        # Black moves on the turned board, as the searchers see it.
+        view = state if player == 'r' else checkers.flip(state)
+        if player == 'b':
+            positions = tuple((7 - x, 7 - y) for x, y in positions)
+        matches = [move for move in checkers.generate_moves(view, 'r')
+                   if (move.origin,) + move.path == positions and bool(move.captured) == (separator == 'x')]
+        assert len(matches) == 1, f"{text} is not a move of {player} on\n{state}"
+        view = checkers.clone(view)
+        view.apply(matches[0])
+        state = view if player == 'r' else checkers.flip(view)
+        player = 'b' if player == 'r' else 'r'
+    return state, player
+
+
+@pytest.mark.parametrize('black, seed, max_plies', [
+    ('depth=2', 0, 30),
+    # This game ends before the limit, so its result comes from winner().
+    ('depth=2,evaluator=material', 2, 60),
+])
+def test_game_replays(black, seed, max_plies):
+    game = selfplay.play_game(selfplay.parse_config('depth=2'), selfplay.parse_config(black),
+                              seed, max_plies=max_plies)
+    assert game['plies'] == len(game['moves']) <= max_plies
+    state, player = replay(game)
+    if checkers.terminal(state):
+        assert game['result'] == selfplay.winner(state, player)
+    else:
+        assert game['result'] == 'draw' and game['plies'] == max_plies
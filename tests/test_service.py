@@ -0,0 +1,76 @@
+"""The line protocol of service.py, driven through pipes like a client would."""
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from boards import POSITIONS
+
+SERVICE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'service.py')
+START = str(POSITIONS['opening-start'])
+# Seconds to wait for an answer before the test fails instead of hanging.
+TIMEOUT = 30
+
+
+@pytest.fixture
+def service():
+    """A service.py process reading stdin, and a queue of the messages it writes."""
+    process = subprocess.Popen([sys.executable, SERVICE], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, text=True)
+    messages = queue.Queue()
+
+    def read():
+        for line in process.stdout:
+            messages.put(json.loads(line))
+        messages.put(None)
+
+    threading.Thread(target=read, daemon=True).start()
+    yield process, messages
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+def send(process, request: dict) -> None:
+    process.stdin.write(json.dumps(request) + '\n')
+    process.stdin.flush()
+
+
+def receive(messages) -> dict:
+    message = messages.get(timeout=TIMEOUT)
+    assert message is not None, "service.py closed stdout"
+    return message
+
+
+def test_requests_over_an_open_pipe(service):
+    process, messages = service
+    # stdin stays open: the answers must come while the service waits for more requests.
+    send(process, {'id': 1, 'board': START, 'depth': 3})
+    depths = []
+    while 'done' not in (message := receive(messages)):
+        assert message['id'] == 1
+        depths.append(message['depth'])
+    assert depths == [1, 2, 3]
+    assert message == {'id': 1, 'done': True, 'depth': 3}
+
+    send(process, {'id': 2, 'board': START, 'depth': 30})
+    message = receive(messages)
+    assert (message['id'], message['depth']) == (2, 1)
+    send(process, {'cancel': 2})
+    while 'done' not in (message := receive(messages)):
+        assert message['id'] == 2
+    assert message['id'] == 2 and message['cancelled'] and message['depth'] >= 1
+
+    # The worker is free again after the cancel.
+    send(process, {'id': 3, 'board': START, 'depth': 2})
+    while 'done' not in (message := receive(messages)):
+        assert message['id'] == 3
+    assert message == {'id': 3, 'done': True, 'depth': 2}
+
+    process.stdin.close()
+    assert messages.get(timeout=TIMEOUT) is None
+    assert process.wait(TIMEOUT) == 0
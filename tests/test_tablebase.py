@@ -0,0 +1,53 @@
+"""Endgame tablebases of checkers.py."""
+import pytest
+
+import checkers
+
+
+@pytest.fixture(scope='module')
+def tablebase(tmp_path_factory):
+    """A tablebase of every board of at most 3 pieces (takes a few seconds to build)."""
+    path = str(tmp_path_factory.mktemp('tablebase') / 'tablebase.bin')
+    checkers.build_tablebase(3, path)
+    with checkers.Tablebase(path) as tablebase:
+        yield tablebase
+
+
+def board(*lines: str) -> checkers.State:
+    return checkers.lines_to_state(list(lines))
+
+
+def test_no_pieces_left_is_a_win(tablebase):
+    state = board("........", "........", "........", "....R...",
+                  "........", "........", "........", "......R.")
+    assert tablebase.value(state, 'b') == checkers.TABLEBASE_WIN
+    assert tablebase.value(checkers.flip(state), 'r') == -checkers.TABLEBASE_WIN
+
+
+@pytest.mark.parametrize('d_limit', [1, 3, 5])
+@pytest.mark.parametrize('engine', ['alphabeta', 'pvs'])
+def test_search_captures_the_last_piece(tablebase, d_limit, engine):
+    # Capturing the black man wins at once; every other move only wins later.
+    state = board("........", "........", "...b....", "....R...",
+                  "........", "........", "........", "......R.")
+    context = checkers.SearchContext(checkers.TranspositionTable(), tablebase=tablebase, engine=engine)
+    move, result = checkers.search_move(state, d_limit, context)
+    assert move.captured == ((3, 2),)
+    assert result.black == 0
+
+
+@pytest.mark.parametrize('content', [b'', checkers.TABLEBASE_MAGIC, checkers.TABLEBASE_MAGIC + b'\0\0',
+                                     checkers.TABLEBASE_MAGIC + b'\xff' * 4, b'NOTATBASE' * 3])
+def test_short_or_foreign_tablebase(tmp_path, content):
+    path = tmp_path / 'tablebase.bin'
+    path.write_bytes(content)
+    with pytest.raises(ValueError, match='not a tablebase'):
+        checkers.Tablebase(str(path))
+
+
+def test_tablebase_of_the_wrong_size(tablebase, tmp_path):
+    path = tmp_path / 'tablebase.bin'
+    with open(tablebase.path, 'rb') as f:
+        path.write_bytes(f.read()[:-2])
+    with pytest.raises(ValueError, match='wrong size'):
+        checkers.Tablebase(str(path))